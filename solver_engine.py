@@ -1,9 +1,16 @@
 import pandas as pd
+import numpy as np
 import ast
 import math
 import time
 import random
 import copy
+import os
+import multiprocessing
+import heapq
+import bisect
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 
 # --- DEFAULT CONFIGURATION ---
@@ -15,9 +22,14 @@ DEFAULT_OPTIMIZATION_WEIGHTS = {
 }
 
 # --- DATA MODEL CLASSES ---
+# Model objects use __slots__ and carry a dense integer `index` (their position
+# in the corresponding model_data dict, assigned by DataIngestor) so hot paths
+# can key arrays and dicts by int instead of hashing string IDs.
 
 class Course:
-    def __init__(self, course_id, name, lecture_duration, lab_duration, lab_type):
+    __slots__ = ('course_id', 'name', 'lecture_duration', 'lab_duration', 'lab_type', 'index')
+    def __init__(self, course_id, name, lecture_duration, lab_duration, lab_type, index=None):
+        self.index = index
         self.course_id = course_id
         self.name = name
         self.lecture_duration = int(lecture_duration)
@@ -27,7 +39,9 @@ class Course:
         return f"Course(id={self.course_id}, name={self.name})"
 
 class Room:
-    def __init__(self, room_id, capacity, room_type, type_of_space):
+    __slots__ = ('room_id', 'capacity', 'room_type', 'type_of_space', 'index')
+    def __init__(self, room_id, capacity, room_type, type_of_space, index=None):
+        self.index = index
         self.room_id = room_id
         self.capacity = int(capacity)
         self.room_type = room_type
@@ -36,7 +50,9 @@ class Room:
         return f"Room(id={self.room_id}, capacity={self.capacity}, type={self.type_of_space})"
 
 class Instructor:
-    def __init__(self, instructor_id, name, qualified_courses_set, not_preferred_slots_set):
+    __slots__ = ('instructor_id', 'name', 'qualified_courses', 'not_preferred_slots', 'index')
+    def __init__(self, instructor_id, name, qualified_courses_set, not_preferred_slots_set, index=None):
+        self.index = index
         self.instructor_id = instructor_id
         self.name = name
         self.qualified_courses = qualified_courses_set
@@ -45,7 +61,9 @@ class Instructor:
         return f"Instructor(id={self.instructor_id}, name={self.name})"
 
 class TimeSlot:
-    def __init__(self, slot_id, day, start_time, end_time):
+    __slots__ = ('slot_id', 'day', 'start_time', 'end_time', 'index')
+    def __init__(self, slot_id, day, start_time, end_time, index=None):
+        self.index = index
         self.slot_id = int(slot_id)
         self.day = day
         self.start_time = start_time
@@ -54,7 +72,9 @@ class TimeSlot:
         return f"TimeSlot(id={self.slot_id}, day={self.day}, time={self.start_time})"
 
 class Section:
-    def __init__(self, section_id, department, level, specialization, student_count):
+    __slots__ = ('section_id', 'department', 'level', 'specialization', 'student_count', 'index')
+    def __init__(self, section_id, department, level, specialization, student_count, index=None):
+        self.index = index
         self.section_id = section_id
         self.department = department
         self.level = int(level)
@@ -64,6 +84,7 @@ class Section:
         return f"Section(id={self.section_id}, level={self.level}, count={self.student_count})"
 
 class AvailableCourse:
+    __slots__ = ('department', 'level', 'specialization', 'course_id', 'preferred_prof', 'preferred_assi')
     def __init__(self, department, level, specialization, course_id, preferred_prof, preferred_assi_set):
         self.department = department
         self.level = int(level)
@@ -96,6 +117,8 @@ class DataIngestor:
             self.model_data['timeslots_df'] = slots_df
             self.model_data['sections'] = self._load_sections()
             self.model_data['available_courses'] = self._load_available_courses()
+            for key in ('courses', 'rooms', 'instructors', 'timeslots', 'sections'):
+                for i, obj in enumerate(self.model_data[key].values()): obj.index = i
             print("All data ingested and model objects created.")
             return self.model_data
         except Exception as e:
@@ -153,15 +176,37 @@ class DataIngestor:
 
 # --- CORE LOGIC CLASSES ---
 
+def _luby(i):
+    """i-th term (1-based) of the Luby restart sequence 1, 1, 2, 1, 1, 2, 4, ..."""
+    k = 1
+    while (1 << k) - 1 < i: k += 1
+    if (1 << k) - 1 == i: return 1 << (k - 1)
+    return _luby(i - (1 << (k - 1)) + 1)
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+def _iter_bits(mask):
+    """Yields the positions of the set bits of `mask`, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
 class ClassSession:
+    __slots__ = ('session_id', 'index', 'course', 'session_type', 'duration_slots', 'sections',
+                 'preferred_instructors', 'total_student_count', 'is_small_group', 'domain', 'symmetry_key')
     _session_counter = 0
     def __init__(self, course, session_type, duration_slots):
         ClassSession._session_counter += 1
         self.session_id = f"S{ClassSession._session_counter}"
+        self.index = ClassSession._session_counter - 1
         self.course, self.session_type, self.duration_slots = course, session_type, duration_slots
         self.sections, self.preferred_instructors = [], set()
         self.total_student_count, self.is_small_group = 0, False
         self.domain = None
+        # Set by DomainBuilder: sessions with equal keys are interchangeable.
+        self.symmetry_key = None
     def add_section(self, section):
         if section not in self.sections:
             self.sections.append(section)
@@ -174,36 +219,93 @@ class ClassSession:
         return f"ClassSession(id={self.session_id}, desc='{self.session_type[:3].upper()}-{self.course.course_id}', students={self.total_student_count})"
 
 class VariableGenerator:
+    """
+    Turns available-course rows into ClassSessions. Sections are indexed by
+    (department, level) and (department, level, specialization) so matching a
+    row is a dict lookup. Lecture sections are bin-packed into as few groups
+    as possible within max_group_capacity and the largest lecture room.
+    """
+    EXACT_PACKING_LIMIT = 12
+
     def __init__(self, model_data, max_group_capacity=75):
         self.model_data, self.max_capacity = model_data, max_group_capacity
         self.all_variables = []
+        self.sections_by_level, self.sections_by_group = {}, {}
+        for sec in model_data['sections'].values():
+            self.sections_by_level.setdefault((sec.department, sec.level), []).append(sec)
+            self.sections_by_group.setdefault((sec.department, sec.level, sec.specialization), []).append(sec)
+        self.group_capacity = self._lecture_group_capacity()
     def generate_all_variables(self):
         ClassSession._session_counter = 0
         for req in self.model_data['available_courses']:
             try:
                 course_obj = self.model_data['courses'][req.course_id]
             except KeyError: continue
-            matching_sections = [sec for sec in self.model_data['sections'].values() if
-                                 (sec.department == req.department and sec.level == req.level and
-                                  (req.specialization == 'Core' or req.specialization == sec.specialization))]
+            if req.specialization == 'Core':
+                matching_sections = self.sections_by_level.get((req.department, req.level), [])
+            else:
+                matching_sections = self.sections_by_group.get((req.department, req.level, req.specialization), [])
             if not matching_sections: continue
             if course_obj.lecture_duration > 0: self._create_lecture_variables(course_obj, matching_sections, req)
             if course_obj.lab_duration > 0: self._create_lab_variables(course_obj, matching_sections, req)
         return self.all_variables
+    def _lecture_group_capacity(self):
+        """max_group_capacity, capped by the largest room a full lecture group may use."""
+        lecture_rooms = [room.capacity for room in self.model_data['rooms'].values()
+                         if room.room_type == 'Lecture' and room.type_of_space not in DomainCompiler.EXCLUDED_LECTURE_SPACES]
+        return min(self.max_capacity, max(lecture_rooms)) if lecture_rooms else self.max_capacity
     def _create_lecture_variables(self, course_obj, sections, request):
-        sections_sorted = sorted(sections, key=lambda s: s.section_id)
-        current_group = None
-        for section in sections_sorted:
-            if current_group is None or (current_group.total_student_count + section.student_count) > self.max_capacity:
-                if current_group:
-                    current_group.set_small_group_flag(self.max_capacity)
-                    self.all_variables.append(current_group)
-                current_group = ClassSession(course_obj, 'Lecture', course_obj.lecture_duration)
-                if request.preferred_prof: current_group.preferred_instructors.add(request.preferred_prof)
-            current_group.add_section(section)
-        if current_group:
-            current_group.set_small_group_flag(self.max_capacity)
-            self.all_variables.append(current_group)
+        for group in self._pack_sections(sections, self.group_capacity):
+            session = ClassSession(course_obj, 'Lecture', course_obj.lecture_duration)
+            if request.preferred_prof: session.preferred_instructors.add(request.preferred_prof)
+            for section in group: session.add_section(section)
+            session.set_small_group_flag(self.max_capacity)
+            self.all_variables.append(session)
+    def _pack_sections(self, sections, capacity):
+        """
+        Bin packing of sections by student_count: first-fit decreasing, then an
+        exact search for fewer groups when there are at most
+        EXACT_PACKING_LIMIT sections. A section larger than `capacity` gets a
+        group of its own. Groups come back in section ID order.
+        """
+        ordered = sorted(sorted(sections, key=lambda s: s.section_id), key=lambda s: s.student_count, reverse=True)
+        bins, loads = [], []
+        for section in ordered:
+            for i, load in enumerate(loads):
+                if load + section.student_count <= capacity:
+                    bins[i].append(section)
+                    loads[i] += section.student_count
+                    break
+            else:
+                bins.append([section])
+                loads.append(section.student_count)
+
+        fitting = [s for s in ordered if s.student_count <= capacity]
+        oversized = len(ordered) - len(fitting)
+        lower = oversized + math.ceil(sum(s.student_count for s in fitting) / capacity) if capacity > 0 else len(bins)
+        if len(bins) > lower and len(ordered) <= self.EXACT_PACKING_LIMIT:
+            for count in range(lower - oversized, len(bins) - oversized):
+                packed = self._pack_exact(fitting, capacity, count)
+                if packed is not None:
+                    bins = packed + [[s] for s in ordered if s.student_count > capacity]
+                    break
+
+        groups = [sorted(group, key=lambda s: s.section_id) for group in bins if group]
+        return sorted(groups, key=lambda g: g[0].section_id)
+    def _pack_exact(self, sections, capacity, count):
+        """Packs `sections` (largest first) into exactly `count` groups by depth-first search, or None."""
+        bins, loads = [[] for _ in range(count)], [0] * count
+        def place(i):
+            if i == len(sections): return True
+            size, tried = sections[i].student_count, set()
+            for b in range(count):
+                if loads[b] + size > capacity or loads[b] in tried: continue
+                tried.add(loads[b])
+                bins[b].append(sections[i]); loads[b] += size
+                if place(i + 1): return True
+                bins[b].pop(); loads[b] -= size
+            return False
+        return [b for b in bins if b] if place(0) else None
     def _create_lab_variables(self, course_obj, sections, request):
         for section in sections:
             lab_session = ClassSession(course_obj, 'Lab', course_obj.lab_duration)
@@ -213,62 +315,134 @@ class VariableGenerator:
             self.all_variables.append(lab_session)
 
 class Domain:
-    def __init__(self, session_variable, model_data):
-        self.variable = session_variable
-        self.timeslot_sequences = self._generate_consecutive_sequences(
-            model_data['timeslots_df'], session_variable.duration_slots)
-        self.rooms = self._filter_rooms(
-            session_variable, model_data['rooms'])
-        self.instructors = self._filter_instructors(
-            session_variable, model_data['instructors'])
-    def _generate_consecutive_sequences(self, all_timeslots_df, duration):
-        sequences, day_slots = [], {}
-        for row in all_timeslots_df.sort_values(by='ID').to_dict('records'):
-            day = row['Day']
-            if day not in day_slots: day_slots[day] = []
-            day_slots[day].append(row['ID'])
-        for day in day_slots:
-            slots = day_slots[day]
-            for i in range(len(slots) - duration + 1):
-                sequence = slots[i : i + duration]
-                if all(sequence[j+1] == sequence[j] + 1 for j in range(len(sequence) - 1)):
-                    sequences.append(sequence)
-        return sequences
-    def _filter_rooms(self, session, all_rooms):
-        valid_rooms, EXCLUDED_LECTURE_SPACES = [], {'Drawing Studio', 'Computer'}
-        for room in all_rooms.values():
-            if room.capacity < session.total_student_count: continue
-            if session.session_type == 'Lab':
-                if room.type_of_space != session.course.lab_type: continue
-            elif session.session_type == 'Lecture':
-                if room.type_of_space in EXCLUDED_LECTURE_SPACES: continue
-                if not session.is_small_group and room.room_type != 'Lecture': continue
-            valid_rooms.append(room)
-        return valid_rooms
-    def _filter_instructors(self, session, all_instructors):
-        course_id = session.course.course_id
+    """
+    Immutable candidate values of a session. Sessions with the same duration,
+    room requirements and instructor candidates share one Domain built by
+    DomainCompiler; the frozensets give O(1) membership tests. room_classes
+    holds, per room, its equivalence class: rooms in one class share building,
+    capacity, Type_of_Space and Type and so are interchangeable.
+    """
+    def __init__(self, timeslot_sequences, rooms, instructors, allowed_sequences, room_classes=None):
+        self.timeslot_sequences = tuple(timeslot_sequences)
+        self.rooms = tuple(rooms)
+        self.room_classes = tuple(room_classes) if room_classes is not None else tuple(range(len(self.rooms)))
+        self.instructors = tuple(instructors)
+        self.sequence_set = frozenset(self.timeslot_sequences)
+        self.sequence_index = {seq: k for k, seq in enumerate(self.timeslot_sequences)}
+        self.room_set = frozenset(self.rooms)
+        self.instructor_set = frozenset(self.instructors)
+        # instructor_id -> sequences that avoid the instructor's not_preferred_slots
+        self.allowed_sequences = allowed_sequences
+    def has_value(self, timeslot_sequence, room, instructor):
+        return (instructor in self.instructor_set and room in self.room_set and
+                tuple(timeslot_sequence) in self.allowed_sequences[instructor.instructor_id])
+    def sequences_for(self, instructor):
+        return [seq for seq in self.timeslot_sequences if seq in self.allowed_sequences[instructor.instructor_id]]
+    def __repr__(self):
+        return (f"Domain(T={len(self.timeslot_sequences)}, R={len(self.rooms)}, I={len(self.instructors)})")
+
+class DomainCompiler:
+    """
+    Precomputes everything domains are made of once per data set: consecutive
+    timeslot sequences per duration, rooms indexed by (type_of_space, room_type)
+    in capacity order so capacity filters are binary searches, instructors
+    indexed by qualified course, and per instructor the sequences that avoid
+    their not_preferred_slots. Identical session requirements map to one
+    shared Domain.
+    """
+    EXCLUDED_LECTURE_SPACES = {'Drawing Studio', 'Computer'}
+
+    def __init__(self, model_data):
+        self.model_data = model_data
+        self.day_slots = {}
+        for row in model_data['timeslots_df'].sort_values(by='ID').to_dict('records'):
+            self.day_slots.setdefault(row['Day'], []).append(row['ID'])
+        self.rooms_by_kind = {}
+        for room in sorted(model_data['rooms'].values(), key=lambda r: r.capacity):
+            capacities, rooms = self.rooms_by_kind.setdefault((room.type_of_space, room.room_type), ([], []))
+            capacities.append(room.capacity)
+            rooms.append(room)
+        self.instructors_by_course = {}
+        for inst in model_data['instructors'].values():
+            for course_id in inst.qualified_courses:
+                self.instructors_by_course.setdefault(course_id, []).append(inst)
+        self.instructor_rank = {inst_id: i for i, inst_id in enumerate(model_data['instructors'])}
+        classes = {}
+        self.room_class = {room.index: classes.setdefault((room.room_id.split()[0], room.capacity, room.type_of_space, room.room_type), len(classes))
+                           for room in model_data['rooms'].values()}
+        self._sequences, self._allowed, self._rooms, self._domains = {}, {}, {}, {}
+
+    def sequences(self, duration):
+        if duration not in self._sequences:
+            sequences = []
+            for slots in self.day_slots.values():
+                for i in range(len(slots) - duration + 1):
+                    sequence = tuple(slots[i : i + duration])
+                    if all(sequence[j+1] == sequence[j] + 1 for j in range(len(sequence) - 1)):
+                        sequences.append(sequence)
+            self._sequences[duration] = tuple(sequences)
+        return self._sequences[duration]
+
+    def allowed_sequences(self, instructor, duration):
+        key = (instructor.instructor_id, duration)
+        if key not in self._allowed:
+            self._allowed[key] = frozenset(seq for seq in self.sequences(duration)
+                                           if not any(slot_id in instructor.not_preferred_slots for slot_id in seq))
+        return self._allowed[key]
+
+    def rooms_for(self, session):
+        if session.session_type == 'Lab':
+            kinds = [k for k in self.rooms_by_kind if k[0] == session.course.lab_type]
+        else:
+            kinds = [k for k in self.rooms_by_kind if k[0] not in self.EXCLUDED_LECTURE_SPACES and
+                     (session.is_small_group or k[1] == 'Lecture')]
+        key = (tuple(kinds), session.total_student_count)
+        if key not in self._rooms:
+            rooms = []
+            for kind in kinds:
+                capacities, kind_rooms = self.rooms_by_kind[kind]
+                rooms.extend(kind_rooms[bisect.bisect_left(capacities, session.total_student_count):])
+            rooms.sort(key=lambda r: r.capacity)
+            self._rooms[key] = tuple(rooms)
+        return self._rooms[key]
+
+    def instructors_for(self, session):
+        all_instructors = self.model_data['instructors']
         if session.preferred_instructors:
-            candidates = [inst for inst in all_instructors.values() if inst.instructor_id in session.preferred_instructors]
+            candidates = [all_instructors[i] for i in session.preferred_instructors if i in all_instructors]
             if candidates:
-                return candidates
-        return [inst for inst in all_instructors.values() if course_id in inst.qualified_courses]
-    def __repr__(self):
-        return (f"Domain for {self.variable.session_id}: "
-                f"T={len(self.timeslot_sequences)}, R={len(self.rooms)}, I={len(self.instructors)}")
+                return sorted(candidates, key=lambda inst: self.instructor_rank[inst.instructor_id])
+        return list(self.instructors_by_course.get(session.course.course_id, ()))
+
+    def domain_for(self, session):
+        rooms = self.rooms_for(session)
+        instructors = self.instructors_for(session)
+        key = (session.duration_slots, id(rooms), tuple(inst.instructor_id for inst in instructors))
+        domain = self._domains.get(key)
+        if domain is None:
+            allowed = {inst.instructor_id: self.allowed_sequences(inst, session.duration_slots) for inst in instructors}
+            domain = Domain(self.sequences(session.duration_slots), rooms, instructors, allowed,
+                            room_classes=[self.room_class[room.index] for room in rooms])
+            self._domains[key] = domain
+        return domain
 
 class DomainBuilder:
     def __init__(self, model_data):
         self.model_data = model_data
+        self.compiler = DomainCompiler(model_data)
     def build_all_domains(self, variables):
         unsolvable_count = 0
         for var in variables:
-            var.domain = Domain(var, self.model_data)
+            var.domain = self.compiler.domain_for(var)
+            var.symmetry_key = (var.course.course_id, var.session_type, tuple(sec.section_id for sec in var.sections),
+                                id(var.domain), frozenset(var.preferred_instructors))
             if not var.domain.timeslot_sequences or not var.domain.rooms or not var.domain.instructors:
                 unsolvable_count += 1
         return unsolvable_count
 
 @dataclass
 class Assignment:
+    __slots__ = ('session', 'timeslot_sequence', 'room', 'instructor')
     session: ClassSession
     timeslot_sequence: list
     room: Room
@@ -281,101 +455,1518 @@ class Assignment:
                 f"Inst={self.instructor.instructor_id})")
 
 class TimetableState:
+    """
+    Occupancy of every instructor, room and section, stored as an integer bitmask
+    over the week's timeslots (bit i is the i-th slot in ID order) in lists keyed
+    by dense resource indices. A conflict check is a handful of AND operations and
+    Python integers grow as needed for finer slot grids.
+    """
     def __init__(self, model_data):
-        self.instructor_schedule = {inst.instructor_id: set() for inst in model_data['instructors'].values()}
-        self.room_schedule = {room.room_id: set() for room in model_data['rooms'].values()}
-        self.section_schedule = {sec.section_id: set() for sec in model_data['sections'].values()}
+        self.slot_bit = {slot.slot_id: 1 << slot.index for slot in model_data['timeslots'].values()}
+        self.instructor_index = {inst.instructor_id: inst.index for inst in model_data['instructors'].values()}
+        self.room_index = {room.room_id: room.index for room in model_data['rooms'].values()}
+        self.section_index = {sec.section_id: sec.index for sec in model_data['sections'].values()}
+        self.instructor_masks = [0] * len(self.instructor_index)
+        self.room_masks = [0] * len(self.room_index)
+        self.section_masks = [0] * len(self.section_index)
+        # Transposed view: which rooms / instructors are busy in each slot.
+        self.slot_rooms = [0] * len(self.slot_bit)
+        self.slot_instructors = [0] * len(self.slot_bit)
+        self._sequence_masks = {}
+        self._mask_positions = {}
+
+    def sequence_mask(self, timeslot_sequence):
+        key = tuple(timeslot_sequence)
+        mask = self._sequence_masks.get(key)
+        if mask is None:
+            mask = 0
+            for slot_id in key: mask |= self.slot_bit[slot_id]
+            self._sequence_masks[key] = mask
+        return mask
+
+    def mask_positions(self, mask):
+        positions = self._mask_positions.get(mask)
+        if positions is None:
+            positions = tuple(_iter_bits(mask))
+            self._mask_positions[mask] = positions
+        return positions
+
+    def rooms_busy(self, mask):
+        """Bitmask (over room indices) of rooms occupied in any slot of `mask`."""
+        busy = 0
+        for pos in self.mask_positions(mask): busy |= self.slot_rooms[pos]
+        return busy
+
+    def instructors_busy(self, mask):
+        busy = 0
+        for pos in self.mask_positions(mask): busy |= self.slot_instructors[pos]
+        return busy
+
+    def room_contention(self, mask, room_bits):
+        """How many of the rooms in `room_bits` are taken in some slot of `mask`."""
+        return _popcount(self.rooms_busy(mask) & room_bits)
 
     def is_consistent(self, session, timeslot_sequence, room, instructor):
         try:
-            for slot_id in timeslot_sequence:
-                if (slot_id in self.instructor_schedule[instructor.instructor_id] or
-                    slot_id in self.room_schedule[room.room_id]):
+            mask = self.sequence_mask(timeslot_sequence)
+            if self.instructor_masks[instructor.index] & mask or self.room_masks[room.index] & mask:
+                return False
+            for section in session.sections:
+                if self.section_masks[section.index] & mask:
                     return False
-                for section in session.sections:
-                    if slot_id in self.section_schedule[section.section_id]:
-                        return False
             return True
-        except KeyError as e:
+        except (KeyError, IndexError, TypeError) as e:
             print(f"--- CRITICAL ERROR in TimetableState.is_consistent: {e} ---")
             return False
 
     def add_assignment(self, assignment):
-        for slot_id in assignment.timeslot_sequence:
-            self.instructor_schedule[assignment.instructor.instructor_id].add(slot_id)
-            self.room_schedule[assignment.room.room_id].add(slot_id)
-            for section in assignment.session.sections:
-                self.section_schedule[section.section_id].add(slot_id)
+        mask = self.sequence_mask(assignment.timeslot_sequence)
+        inst_idx, room_idx = assignment.instructor.index, assignment.room.index
+        self.instructor_masks[inst_idx] |= mask
+        self.room_masks[room_idx] |= mask
+        for section in assignment.session.sections:
+            self.section_masks[section.index] |= mask
+        for pos in self.mask_positions(mask):
+            self.slot_instructors[pos] |= 1 << inst_idx
+            self.slot_rooms[pos] |= 1 << room_idx
 
     def remove_assignment(self, assignment):
-        for slot_id in assignment.timeslot_sequence:
-            self.instructor_schedule[assignment.instructor.instructor_id].remove(slot_id)
-            self.room_schedule[assignment.room.room_id].remove(slot_id)
-            for section in assignment.session.sections:
-                self.section_schedule[section.section_id].remove(slot_id)
+        mask = self.sequence_mask(assignment.timeslot_sequence)
+        inst_idx, room_idx = assignment.instructor.index, assignment.room.index
+        self.instructor_masks[inst_idx] &= ~mask
+        self.room_masks[room_idx] &= ~mask
+        for section in assignment.session.sections:
+            self.section_masks[section.index] &= ~mask
+        for pos in self.mask_positions(mask):
+            self.slot_instructors[pos] &= ~(1 << inst_idx)
+            self.slot_rooms[pos] &= ~(1 << room_idx)
+
+    def reserve(self, rooms=(), instructors=()):
+        """
+        Marks rooms / instructors busy, e.g. because another part of the problem
+        owns them there. Both take (index, slot mask) pairs.
+        """
+        for room_idx, mask in rooms:
+            self.room_masks[room_idx] |= mask
+            for pos in self.mask_positions(mask): self.slot_rooms[pos] |= 1 << room_idx
+        for inst_idx, mask in instructors:
+            self.instructor_masks[inst_idx] |= mask
+            for pos in self.mask_positions(mask): self.slot_instructors[pos] |= 1 << inst_idx
+
+    def section_slots(self, section_id):
+        mask = self.section_masks[self.section_index[section_id]]
+        return {slot_id for slot_id, bit in self.slot_bit.items() if mask & bit}
+
+    def copy(self):
+        """Cheap copy: the index maps are shared, only the occupancy lists are duplicated."""
+        clone = copy.copy(self)
+        clone.instructor_masks = list(self.instructor_masks)
+        clone.room_masks = list(self.room_masks)
+        clone.section_masks = list(self.section_masks)
+        clone.slot_rooms = list(self.slot_rooms)
+        clone.slot_instructors = list(self.slot_instructors)
+        return clone
+
+class DomainMasks:
+    """
+    Bitmask view of a shared Domain used by the search: one slot mask per
+    timeslot sequence, the instructors allowed in each sequence (after
+    not_preferred_slots) and the candidate rooms, all over TimetableState indices.
+    """
+    def __init__(self, domain, state):
+        d = domain
+        self.seq_masks = [state.sequence_mask(seq) for seq in d.timeslot_sequences]
+        self.inst_bits = [sum(1 << inst.index for inst in d.instructors
+                              if seq in d.allowed_sequences[inst.instructor_id])
+                          for seq in d.timeslot_sequences]
+        self.room_bits = sum(1 << room.index for room in d.rooms)
+        self.mask_index = {mask: k for k, mask in enumerate(self.seq_masks)}
+        self.covering = {}
+        for k, mask in enumerate(self.seq_masks):
+            for pos in state.mask_positions(mask):
+                self.covering[pos] = self.covering.get(pos, 0) | (1 << k)
+
+    def overlapping(self, mask, state):
+        """Bitmask of the sequence indices that share a slot with `mask`."""
+        seqs = 0
+        for pos in state.mask_positions(mask): seqs |= self.covering.get(pos, 0)
+        return seqs
+
+    def is_viable(self, k, state, sections):
+        """True if sequence k still has a free section, instructor and room."""
+        mask = self.seq_masks[k]
+        for sec_idx in sections:
+            if state.section_masks[sec_idx] & mask: return False
+        return bool(self.inst_bits[k] & ~state.instructors_busy(mask)) and bool(self.room_bits & ~state.rooms_busy(mask))
+
+class SearchFrame:
+    """One level of the Phase 1 search stack."""
+    def __init__(self, var, values, depth):
+        self.var = var
+        self.values = iter(values)
+        self.depth = depth
+        self.assignment = None
+        self.mark = 0
+        self.conflicts = set()
 
 class BacktrackingSolver:
-    def __init__(self, variables, model_data):
+    """
+    Phase 1 CSP search, run on an explicit stack so the depth is not bounded by
+    Python's recursion limit.
+
+    `propagation` selects what happens after each assignment: None (plain
+    chronological backtracking), 'forward' (prune the timeslot sequences of
+    variables sharing a section, instructor or room and fail on an empty domain)
+    or 'ac3' (forward checking plus arc consistency between variables that can
+    never overlap in time).
+
+    `variable_ordering` is 'static' (sorted once by get_domain_size) or 'mrv'
+    (fewest remaining timeslot sequences first, ties broken by how many
+    sections, instructors and rooms the variable shares with others). 'mrv'
+    needs the live domains, so it turns on forward checking if `propagation`
+    is None.
+
+    With `backjumping` a dead end jumps straight back to the deepest
+    assignment that took a slot from the stuck variable's section, instructors
+    or rooms (conflict-directed backjumping), and every conflict set of at most
+    `max_nogood_size` assignments is kept as a nogood that rejects the same
+    combination wherever it reappears. AC-3 prunings are not explained, so
+    under 'ac3' a wipeout conservatively blames every earlier assignment.
+
+    `node_limit` / `time_limit` (seconds) bound the whole solve; when either
+    runs out solve() gives up and sets budget_exhausted. `restart_policy`
+    ('luby' or 'geometric') restarts the search after a growing number of dead
+    ends (`restart_base`, times `restart_factor` per run for 'geometric').
+    Restarts, or an explicit `seed`, randomise tie-breaking in both variable
+    and value ordering with a reproducible random.Random(seed). Learned nogoods
+    are kept across restarts.
+
+    `initial_state` (a TimetableState) makes the search start from slots that
+    are already occupied, e.g. the fixed part of a timetable being repaired;
+    it is copied, never modified, and solve() returns only the new assignments.
+    `sequence_cost(var, seq, state)`, if given, is tried before contention
+    when ordering timeslot sequences, steering the first solution found
+    towards cheap placements. Setting `stop_event` (a multiprocessing Event)
+    ends the search like an exhausted budget.
+
+    With `symmetry` the search skips permutations of equivalent choices: for a
+    given sequence and instructor only one room per room class and occupancy
+    is tried (only unused rooms when backjumping, where the explanation must
+    stay valid), and sessions with the same symmetry_key take strictly
+    increasing timeslot sequences in session order.
+    """
+    def __init__(self, variables, model_data, propagation=None, variable_ordering='static',
+                 backjumping=False, max_nogood_size=3, node_limit=None, time_limit=None,
+                 restart_policy=None, restart_base=50, restart_factor=1.5, seed=None, initial_state=None,
+                 sequence_cost=None, stop_event=None, symmetry=True):
+        if propagation not in (None, 'forward', 'ac3'):
+            raise ValueError(f"Unknown propagation mode: {propagation}")
+        if variable_ordering not in ('static', 'mrv'):
+            raise ValueError(f"Unknown variable ordering: {variable_ordering}")
+        if restart_policy not in (None, 'luby', 'geometric'):
+            raise ValueError(f"Unknown restart policy: {restart_policy}")
+        if variable_ordering == 'mrv' and propagation is None:
+            propagation = 'forward'
         self.unassigned_variables = list(variables)
-        self.state = TimetableState(model_data)
+        self.initial_state = initial_state
+        self.sequence_cost = sequence_cost
+        self.stop_event = stop_event
+        self.symmetry = symmetry
+        # session index -> (previous, next) interchangeable session index, or None
+        self._twins, self._sequence_of = {}, {}
+        if symmetry:
+            groups = {}
+            for var in variables:
+                if var.symmetry_key is not None: groups.setdefault(var.symmetry_key, []).append(var.index)
+            for group in groups.values():
+                group.sort()
+                for i, idx in enumerate(group):
+                    if len(group) > 1:
+                        self._twins[idx] = (group[i - 1] if i else None, group[i + 1] if i + 1 < len(group) else None)
+        self.state = initial_state.copy() if initial_state is not None else TimetableState(model_data)
         self.solution = []
         self.model_data = model_data
         self.nodes_visited = 0
+        self.propagation = propagation
+        self.variable_ordering = variable_ordering
+        self.domain_wipeouts = 0
+        self.backjumping = backjumping
+        self.max_nogood_size = max_nogood_size
+        self.backjumps = 0
+        self.nogoods = set()
+        self._nogood_index = {}
+        self._value_at, self._value_of = [], {}
+        self._owners = {}
+        self._masks, self._room_order, self._sections = {}, {}, {}
+        self.node_limit, self.time_limit = node_limit, time_limit
+        self.restart_policy, self.restart_base, self.restart_factor = restart_policy, restart_base, restart_factor
+        self.randomize = seed is not None or restart_policy is not None
+        self.rng = random.Random(seed if seed is not None else 0)
+        self.restarts = 0
+        self.backtracks = 0
+        self.budget_exhausted = False
 
     def solve(self):
-        self.unassigned_variables.sort(key=self.get_domain_size)
-        solution_found = self.recursive_solve()
-        if solution_found:
-            return self.solution, self.state
-        else:
-            return None, None
+        variables = list(self.unassigned_variables)
+        self._started = time.time()
+        run = 0
+        while True:
+            self._begin_run(variables, run)
+            if self.propagation and not self._init_propagation():
+                return None, None
+            result = self._search(self._run_cutoff(run))
+            if result:
+                self.unassigned_variables = []
+                return self.solution, self.state
+            if result is False or self.budget_exhausted:
+                return None, None
+            run += 1
+            self.restarts += 1
+
+    def _begin_run(self, variables, run):
+        """Resets the search for a (re)start, drawing fresh random tie-breakers."""
+        if run:
+            self.state = self.initial_state.copy() if self.initial_state is not None else TimetableState(self.model_data)
+            self.solution = []
+            self._owners, self._value_at, self._value_of = {}, [], {}
+            self._sequence_of = {}
+        self._tiebreak = {var.index: self.rng.random() if self.randomize else 0 for var in variables}
+        self._room_order = {}
+        self.unassigned_variables = sorted(variables, key=lambda v: (self.get_domain_size(v), self._tiebreak[v.index]))
+        self._order = list(self.unassigned_variables)
+
+    def _run_cutoff(self, run):
+        """Dead ends allowed in this run before restarting, or None."""
+        if self.restart_policy == 'luby':
+            return self.restart_base * _luby(run + 1)
+        if self.restart_policy == 'geometric':
+            return int(self.restart_base * self.restart_factor ** run)
+        return None
+
+    def _out_of_budget(self):
+        if self.node_limit is not None and self.nodes_visited >= self.node_limit:
+            return True
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        return self.time_limit is not None and time.time() - self._started >= self.time_limit
 
     def get_domain_size(self, var):
         d = var.domain
         return len(d.timeslot_sequences) * len(d.rooms) * len(d.instructors)
 
     def get_ordered_domain_values(self, var):
-        all_combinations = []
-        for time_seq in var.domain.timeslot_sequences:
-            for inst in var.domain.instructors:
-                if any(slot_id in inst.not_preferred_slots for slot_id in time_seq):
-                    continue 
-                for room in var.domain.rooms:
-                    all_combinations.append((time_seq, room, inst))
-        
-        def heuristic_score(value_tuple):
-            _, _, inst = value_tuple
-            score = 0
-            if inst.instructor_id in var.preferred_instructors:
-                score -= 10
-            return score
-            
-        all_combinations.sort(key=heuristic_score)
-        return all_combinations
+        """
+        Lazily yields the (time_seq, room, inst) values that fit the current
+        state, without materialising the full time x instructor x room product.
+        Preferred instructors come first; within them, timeslot sequences where
+        the fewest of this session's candidate rooms and instructors are already
+        taken (least constraining), then rooms smallest-first so large rooms stay
+        free for large groups.
+        """
+        m, st, sections = self._domain_masks(var), self.state, self._section_indices(var)
+        seqs = var.domain.timeslot_sequences
+        def contention(k):
+            mask = m.seq_masks[k]
+            return st.room_contention(mask, m.room_bits) + _popcount(st.instructors_busy(mask) & m.inst_bits[k])
+        jitter = [self.rng.random() for _ in seqs] if self.randomize else range(len(seqs))
+        if self.sequence_cost:
+            order = sorted(range(len(seqs)), key=lambda k: (self.sequence_cost(var, seqs[k], st), contention(k), jitter[k]))
+        else:
+            order = sorted(range(len(seqs)), key=lambda k: (contention(k), jitter[k]))
+        rooms = self._rooms_by_capacity(var)
+        preferred = [inst for inst in var.domain.instructors if inst.instructor_id in var.preferred_instructors]
+        others = [inst for inst in var.domain.instructors if inst.instructor_id not in var.preferred_instructors]
+        if self.randomize:
+            self.rng.shuffle(preferred)
+            self.rng.shuffle(others)
+        lo, hi = self._twin_bounds(var, len(seqs))
+        for group in (preferred, others):
+            for k in order:
+                if not lo < k < hi: continue
+                mask = m.seq_masks[k]
+                if self.propagation and not (self._live[var.index] >> k) & 1: continue
+                if any(st.section_masks[sec_idx] & mask for sec_idx in sections): continue
+                busy_rooms = None
+                for inst in group:
+                    inst_idx = inst.index
+                    if not (m.inst_bits[k] >> inst_idx) & 1 or st.instructor_masks[inst_idx] & mask: continue
+                    if busy_rooms is None: busy_rooms = st.rooms_busy(mask)
+                    tried = set() if self.symmetry else None
+                    for room, room_idx, room_class in rooms:
+                        if room is None:  # RoomFreeSolver leaves the room open
+                            yield seqs[k], None, inst
+                            continue
+                        if (busy_rooms >> room_idx) & 1: continue
+                        if tried is not None:
+                            occupancy = st.room_masks[room_idx]
+                            if not (self.backjumping and occupancy):
+                                if (room_class, occupancy) in tried: continue
+                                tried.add((room_class, occupancy))
+                        yield seqs[k], room, inst
+
+    def _twin_bounds(self, var, count):
+        """Exclusive range of sequence indices left to `var` by its assigned interchangeable neighbours."""
+        twins = self._twins.get(var.index)
+        if twins is None: return -1, count
+        prev, nxt = twins
+        return self._sequence_of.get(prev, -1), self._sequence_of.get(nxt, count)
+
+    def _twin_culprits(self, var):
+        """Depths of the interchangeable sessions whose placement bounds `var`."""
+        return {self._value_of[idx][1] for idx in self._twins.get(var.index, ()) if idx in self._sequence_of}
+
+    def _domain_masks(self, var):
+        m = self._masks.get(id(var.domain))
+        if m is None:
+            m = self._masks[id(var.domain)] = DomainMasks(var.domain, self.state)
+        return m
+
+    def _section_indices(self, var):
+        sections = self._sections.get(var.index)
+        if sections is None:
+            sections = self._sections[var.index] = [sec.index for sec in var.sections]
+        return sections
+
+    def _rooms_by_capacity(self, var):
+        """Domain rooms (already capacity-sorted) with equal capacities shuffled when randomising."""
+        rooms = self._room_order.get(id(var.domain))
+        if rooms is None:
+            rooms = [(room, room.index, room_class) for room, room_class in zip(var.domain.rooms, var.domain.room_classes)]
+            if self.randomize:
+                self.rng.shuffle(rooms)
+                rooms.sort(key=lambda r: r[0].capacity)
+            self._room_order[id(var.domain)] = rooms
+        return rooms
 
-    def recursive_solve(self):
+    def _search(self, cutoff=None):
+        """
+        Depth-first search with one SearchFrame per assigned variable. A frame
+        whose values are exhausted is popped, which backtracks to its parent.
+        Returns True on a full assignment, False once the space is exhausted and
+        None when the run's dead-end `cutoff` or the overall budget is reached.
+        """
+        failures = 0
         self.nodes_visited += 1
-        if not self.unassigned_variables:
-            return True 
-        
-        var = self.unassigned_variables.pop(0) 
+        var = self._select_variable()
+        if var is None: return True
+        stack = [SearchFrame(var, self.get_ordered_domain_values(var), 0)]
+        while stack:
+            frame = stack[-1]
+            if frame.assignment is not None:
+                self._retract(frame)
+            assignment = self._next_assignment(frame)
+            if assignment is None:
+                self.backtracks += 1
+                failures += 1
+                if self.backjumping:
+                    conflicts = frame.conflicts | self._culprits(frame.var) | self._twin_culprits(frame.var)
+                    if not conflicts: return False
+                    self._learn_nogood(conflicts)
+                    target = max(conflicts)
+                    stack.pop()
+                    while stack[-1].depth > target:
+                        self._retract(stack.pop())
+                        self.backjumps += 1
+                    conflicts.discard(target)
+                    stack[-1].conflicts |= conflicts
+                else:
+                    stack.pop()
+                    if not stack: return False
+                if cutoff is not None and failures >= cutoff: return None
+                continue
 
-        for time_seq, room, inst in self.get_ordered_domain_values(var):
-            if self.state.is_consistent(var, time_seq, room, inst):
-                assignment = Assignment(var, time_seq, room, inst)
-                self.state.add_assignment(assignment)
-                self.solution.append(assignment)
-                
-                if self.recursive_solve():
-                    return True 
-                
-                self.solution.pop()
-                self.state.remove_assignment(assignment)
-        
-        self.unassigned_variables.insert(0, var)
+            frame.assignment = assignment
+            self.state.add_assignment(assignment)
+            self.solution.append(assignment)
+            if frame.var.index in self._twins:
+                self._sequence_of[frame.var.index] = frame.var.domain.sequence_index[tuple(assignment.timeslot_sequence)]
+            if self.backjumping: self._record_owner(assignment, frame.depth)
+            if self.propagation:
+                frame.mark = len(self._trail)
+                self._assigned.add(frame.var.index)
+                if not self._propagate(assignment):
+                    if self.backjumping: frame.conflicts |= self._wipeout_culprits(frame.depth)
+                    self.backtracks += 1
+                    failures += 1
+                    if cutoff is not None and failures >= cutoff: return None
+                    continue
+
+            self.nodes_visited += 1
+            if self._out_of_budget():
+                self.budget_exhausted = True
+                return None
+            var = self._select_variable()
+            if var is None: return True
+            stack.append(SearchFrame(var, self.get_ordered_domain_values(var), len(self.solution)))
         return False
 
+    def _next_assignment(self, frame):
+        var = frame.var
+        for time_seq, room, inst in frame.values:
+            if not self.state.is_consistent(var, time_seq, room, inst):
+                continue
+            if self._nogood_index:
+                culprits = self._nogood_culprits((var.index, tuple(time_seq), room.index, inst.index))
+                if culprits is not None:
+                    frame.conflicts |= culprits
+                    continue
+            return Assignment(var, time_seq, room, inst)
+        return None
+
+    def _retract(self, frame):
+        if self.propagation:
+            self._assigned.discard(frame.var.index)
+            self._undo_to(frame.mark)
+            self._push_candidate(frame.var)
+        if self.backjumping: self._clear_owner(frame.assignment)
+        self._sequence_of.pop(frame.var.index, None)
+        self.solution.pop()
+        self.state.remove_assignment(frame.assignment)
+        frame.assignment = None
+
+    # --- Conflict-directed backjumping ---
+
+    def _resource_keys(self, assignment):
+        st = self.state
+        positions = st.mask_positions(st.sequence_mask(assignment.timeslot_sequence))
+        inst_idx, room_idx = assignment.instructor.index, assignment.room.index
+        for pos in positions:
+            yield ('i', inst_idx, pos)
+            yield ('r', room_idx, pos)
+            for sec in assignment.session.sections: yield ('s', sec.index, pos)
+
+    def _record_owner(self, assignment, depth):
+        for key in self._resource_keys(assignment): self._owners[key] = depth
+        literal = (assignment.session.index, tuple(assignment.timeslot_sequence), assignment.room.index, assignment.instructor.index)
+        self._value_at.append(literal)
+        self._value_of[literal[0]] = (literal, depth)
+
+    def _clear_owner(self, assignment):
+        for key in self._resource_keys(assignment): del self._owners[key]
+        del self._value_of[self._value_at.pop()[0]]
+
+    def _culprits(self, var):
+        """Depths of the assignments that block some value of `var` in the current state."""
+        if self.propagation == 'ac3':
+            return set(range(len(self.solution)))
+        m, st, owners = self._domain_masks(var), self.state, self._owners
+        sections = self._section_indices(var)
+        culprits = set()
+        for k, mask in enumerate(m.seq_masks):
+            positions = st.mask_positions(mask)
+            # Prefer the smallest sufficient explanation: a busy section, else all
+            # allowed instructors busy, else all rooms busy, else both partial sets.
+            # Slots taken by an initial_state assignment have no owner: they are
+            # blocked at every depth and contribute nothing to the conflict set.
+            if any(st.section_masks[sec_idx] & mask for sec_idx in sections):
+                blocked = {owners[('s', sec_idx, pos)] for sec_idx in sections for pos in positions if ('s', sec_idx, pos) in owners}
+            else:
+                inst_blocked, room_blocked = set(), set()
+                for pos in positions:
+                    inst_blocked.update(owners.get(('i', inst_idx, pos)) for inst_idx in _iter_bits(m.inst_bits[k] & st.slot_instructors[pos]))
+                    room_blocked.update(owners.get(('r', room_idx, pos)) for room_idx in _iter_bits(m.room_bits & st.slot_rooms[pos]))
+                if not m.inst_bits[k] & ~st.instructors_busy(mask):
+                    blocked = inst_blocked
+                elif not m.room_bits & ~st.rooms_busy(mask):
+                    blocked = room_blocked
+                else:
+                    blocked = inst_blocked | room_blocked
+            culprits |= blocked
+        culprits.discard(None)
+        return culprits
+
+    def _wipeout_culprits(self, depth):
+        if self._wiped is None or self.propagation == 'ac3':
+            return set(range(depth))
+        culprits = self._culprits(self._wiped)
+        culprits.discard(depth)
+        return culprits
+
+    def _learn_nogood(self, conflicts):
+        if len(conflicts) > self.max_nogood_size: return
+        nogood = frozenset(self._value_at[d] for d in conflicts)
+        if nogood in self.nogoods: return
+        self.nogoods.add(nogood)
+        for literal in nogood: self._nogood_index.setdefault(literal, []).append(nogood)
+
+    def _nogood_culprits(self, literal):
+        """If taking `literal` would complete a recorded nogood, the depths of its other members."""
+        for nogood in self._nogood_index.get(literal, ()):
+            others = [l for l in nogood if l != literal]
+            if all(self._value_of.get(l[0], (None,))[0] == l for l in others):
+                return {self._value_of[l[0]][1] for l in others}
+        return None
+
+    def _select_variable(self):
+        if self.variable_ordering == 'static':
+            depth = len(self.solution)
+            return self._order[depth] if depth < len(self._order) else None
+        heap = self._heap
+        while heap:
+            count, _, _, var = heap[0]
+            if var.index in self._assigned or count != _popcount(self._live[var.index]):
+                heapq.heappop(heap)
+                continue
+            return var
+        return None
+
+    def _push_candidate(self, var):
+        if self.variable_ordering == 'mrv' and var.index not in self._assigned:
+            heapq.heappush(self._heap, (_popcount(self._live[var.index]), -self._degree[var.index], self._rank[var.index], var))
+
+    # --- Constraint propagation ---
+
+    def _init_propagation(self):
+        variables = self.unassigned_variables
+        self._live, self._trail, self._assigned = {}, [], set()
+        self._by_section, self._by_instructor, self._single_room = {}, {}, {}
+        # Variables per shared Domain, the domains of each instructor and of each
+        # room pool (a domain's room bitmask), and the pools containing each room.
+        self._by_domain, self._domains_by_instructor, self._domains_by_pool, self._pools_by_room = {}, {}, {}, {}
+        st, available = self.state, {}
+        for var in variables:
+            m = self._domain_masks(var)
+            key = id(var.domain)
+            if key not in self._by_domain:
+                available[key] = sum(1 << k for k in range(len(m.seq_masks)) if m.is_viable(k, st, ()))
+                for inst in var.domain.instructors: self._domains_by_instructor.setdefault(inst.index, []).append(key)
+                if m.room_bits not in self._domains_by_pool:
+                    for room in var.domain.rooms: self._pools_by_room.setdefault(room.index, []).append(m.room_bits)
+                self._domains_by_pool.setdefault(m.room_bits, []).append(key)
+            self._by_domain.setdefault(key, []).append(var)
+            live = available[key]
+            for sec_idx in self._section_indices(var): live &= ~m.overlapping(st.section_masks[sec_idx], st)
+            self._live[var.index] = live
+            for sec in var.sections: self._by_section.setdefault(sec.index, []).append(var)
+            for inst in var.domain.instructors: self._by_instructor.setdefault(inst.index, []).append(var)
+            if len(var.domain.rooms) == 1: self._single_room.setdefault(var.domain.rooms[0].index, []).append(var)
+        self._seq_masks = {seq_mask for m in self._masks.values() for seq_mask in m.seq_masks}
+        if any(live == 0 for live in self._live.values()):
+            self.domain_wipeouts += 1
+            return False
+
+        # Pairs of variables that can never share a slot: a common section, or
+        # the same single possible instructor or room.
+        self._mutex = {var.index: [] for var in variables}
+        for var in variables:
+            related = {v for sec in var.sections for v in self._by_section[sec.index]}
+            if len(var.domain.instructors) == 1:
+                related.update(v for v in self._by_instructor[var.domain.instructors[0].index] if len(v.domain.instructors) == 1)
+            if len(var.domain.rooms) == 1:
+                related.update(self._single_room[var.domain.rooms[0].index])
+            related.discard(var)
+            self._mutex[var.index] = list(related)
+        if self.variable_ordering == 'mrv':
+            self._rank = {var.index: i for i, var in enumerate(variables)}
+            room_users = {}
+            for domain_vars in self._by_domain.values():
+                for room in domain_vars[0].domain.rooms: room_users[room.index] = room_users.get(room.index, 0) + len(domain_vars)
+            shared = {key: sum(len(self._by_instructor[inst.index]) for inst in domain_vars[0].domain.instructors) +
+                           sum(room_users[room.index] for room in domain_vars[0].domain.rooms)
+                      for key, domain_vars in self._by_domain.items()}
+            self._degree = {var.index: sum(len(self._by_section[sec.index]) for sec in var.sections) + shared[id(var.domain)]
+                            for var in variables}
+            self._heap = []
+            for var in variables: self._push_candidate(var)
+        if self.propagation == 'ac3':
+            return self._ac3([(v, w) for v in variables for w in self._mutex[v.index]])
+        return True
+
+    def _set_live(self, var, live):
+        self._trail.append((var, self._live[var.index]))
+        self._live[var.index] = live
+        self._push_candidate(var)
+
+    def _undo_to(self, mark):
+        while len(self._trail) > mark:
+            var, live = self._trail.pop()
+            self._live[var.index] = live
+            self._push_candidate(var)
+
+    def _propagate(self, assignment):
+        """
+        Forward checking after `assignment`, followed by AC-3 when enabled.
+        False on a wipeout. Instructor and room availability is the same for
+        every session of a Domain: instructors are checked once per domain of
+        the assigned instructor, rooms once per room pool (distinct room set)
+        containing a touched room. Sessions sharing a section lose every
+        sequence overlapping the assignment.
+        """
+        st = self.state
+        mask = st.sequence_mask(assignment.timeslot_sequence)
+        dead = {}
+        for key in self._domains_by_instructor.get(assignment.instructor.index, ()):
+            m, gone = self._masks[key], 0
+            for k in _iter_bits(m.overlapping(mask, st)):
+                if not m.inst_bits[k] & ~st.instructors_busy(m.seq_masks[k]): gone |= 1 << k
+            if gone: dead[key] = gone
+        pools = set()
+        for room_idx in self._touched_rooms(assignment, mask): pools.update(self._pools_by_room.get(room_idx, ()))
+        if pools:
+            busy = {seq_mask: st.rooms_busy(seq_mask) for seq_mask in self._seq_masks if seq_mask & mask}
+            for room_bits in pools:
+                full = [seq_mask for seq_mask, rooms in busy.items() if not room_bits & ~rooms]
+                if not full: continue
+                for key in self._domains_by_pool[room_bits]:
+                    m, gone = self._masks[key], 0
+                    for seq_mask in full:
+                        k = m.mask_index.get(seq_mask)
+                        if k is not None: gone |= 1 << k
+                    if gone: dead[key] = dead.get(key, 0) | gone
+        candidates = [var for sec in assignment.session.sections for var in self._by_section[sec.index]]
+        sharing = {var.index for var in candidates}
+        for key in dead: candidates.extend(self._by_domain[key])
+
+        changed, seen = [], set()
+        for var in candidates:
+            if var.index in self._assigned or var.index in seen: continue
+            seen.add(var.index)
+            key, live = id(var.domain), self._live[var.index]
+            new_live = live & ~dead.get(key, 0)
+            if var.index in sharing: new_live &= ~self._masks[key].overlapping(mask, st)
+            if new_live != live:
+                self._set_live(var, new_live)
+                if not new_live:
+                    self.domain_wipeouts += 1
+                    self._wiped = var
+                    return False
+                changed.append(var)
+        self._wiped = None
+        if self.propagation == 'ac3':
+            return self._ac3([(w, v) for v in changed for w in self._mutex[v.index]])
+        return True
+
+    def _touched_rooms(self, assignment, mask):
+        """Indices of the rooms whose availability `assignment` changed."""
+        return (assignment.room.index,)
+
+    def _ac3(self, queue):
+        queue = deque(queue)
+        while queue:
+            x, y = queue.popleft()
+            if x.index in self._assigned or y.index in self._assigned: continue
+            if self._revise(x, y):
+                if not self._live[x.index]:
+                    self.domain_wipeouts += 1
+                    return False
+                queue.extend((z, x) for z in self._mutex[x.index] if z is not y)
+        return True
+
+    def _revise(self, x, y):
+        """Drops the sequences of x that overlap every remaining sequence of y."""
+        y_masks = [self._domain_masks(y).seq_masks[k] for k in _iter_bits(self._live[y.index])]
+        x_masks, live = self._domain_masks(x).seq_masks, self._live[x.index]
+        new_live = live
+        for k in _iter_bits(live):
+            if all(ym & x_masks[k] for ym in y_masks):
+                new_live &= ~(1 << k)
+        if new_live == live: return False
+        self._set_live(x, new_live)
+        return True
+
+class MinConflictsSolver:
+    """
+    Phase 1 local search for instances too large for BacktrackingSolver. Starts
+    from a greedy complete assignment that may double-book sections, rooms or
+    instructors, then repeatedly moves a random conflicted session to the value
+    with the fewest hard violations (a random value with `walk_probability`).
+    After `restart_steps` steps without a new best conflict count it restarts
+    from a fresh greedy assignment. solve() stops at `time_limit` seconds and
+    returns (solution, state) like BacktrackingSolver, or (None, None) with the
+    best conflict count in `conflicts` and the clashes in conflict_report().
+    Setting `stop_event` (a multiprocessing Event) ends the search early.
+    """
+    DIAGNOSTIC_TIME_LIMIT = 5.0  # enough for conflict_report() on an instance known to be infeasible
+
+    def __init__(self, variables, model_data, time_limit=30.0, walk_probability=0.1, restart_steps=None, seed=0,
+                 stop_event=None):
+        self.variables = list(variables)
+        self.model_data = model_data
+        self.time_limit = time_limit
+        self.walk_probability = walk_probability
+        self.restart_steps = restart_steps or 20 * max(len(self.variables), 1)
+        self.rng = random.Random(seed)
+        self.stop_event = stop_event
+        self.slot_pos = {slot.slot_id: slot.index for slot in model_data['timeslots'].values()}
+        self.steps = 0
+        self.restarts = 0
+        self.conflicts = None
+        self.best_values = None
+        self.unplaceable = [var for var in self.variables
+                            if not (var.domain.rooms and any(var.domain.sequences_for(inst) for inst in var.domain.instructors))]
+
+    def solve(self):
+        if self.unplaceable:
+            self.conflicts = len(self.unplaceable)
+            return None, None
+        self._started = time.time()
+        while True:
+            self._greedy_start()
+            best, stale = self._total, 0
+            while self._total and stale < self.restart_steps and not self._out_of_budget():
+                var = self.rng.choice(tuple(self._conflicted.values()))
+                if self.rng.random() < self.walk_probability:
+                    value = self._random_value(var)
+                else:
+                    value = self._min_conflicts_value(var)
+                self._place(var, value)
+                self.steps += 1
+                if self._total < best:
+                    best, stale = self._total, 0
+                else:
+                    stale += 1
+            if self.conflicts is None or self._total < self.conflicts:
+                self.conflicts, self.best_values = self._total, dict(self._values)
+            if not self._total or self._out_of_budget():
+                break
+            self.restarts += 1
+
+        if self.conflicts > 0:
+            return None, None
+        state = TimetableState(self.model_data)
+        solution = []
+        for var in self.variables:
+            assignment = Assignment(var, *self.best_values[var.index])
+            state.add_assignment(assignment)
+            solution.append(assignment)
+        return solution, state
+
+    def _out_of_budget(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        return self.time_limit is not None and time.time() - self._started >= self.time_limit
+
+    def conflict_report(self, limit=None):
+        """Human-readable hard conflicts of the best assignment found."""
+        if self.unplaceable:
+            report = [f"Session {var.session_id} has no usable timeslot, room and instructor combination" for var in self.unplaceable]
+            return report[:limit] if limit else report
+        if not self.best_values:
+            return []
+        by_index = {var.index: var for var in self.variables}
+        slot_ids = {pos: slot_id for slot_id, pos in self.slot_pos.items()}
+        names = {'s': 'Section', 'i': 'Instructor', 'r': 'Room'}
+        labels = {'s': {sec.index: sec.section_id for sec in self.model_data['sections'].values()},
+                  'i': {inst.index: inst.instructor_id for inst in self.model_data['instructors'].values()},
+                  'r': {room.index: room.room_id for room in self.model_data['rooms'].values()}}
+        occupants = {}
+        for idx, value in self.best_values.items():
+            for key in self._keys(by_index[idx], value):
+                occupants.setdefault(key, []).append(by_index[idx].session_id)
+        report = [f"{names[kind]} {labels[kind][label]} is double-booked at slot {slot_ids[pos]}: {', '.join(sessions)}"
+                  for (kind, label, pos), sessions in sorted(occupants.items()) if len(sessions) > 1]
+        return report[:limit] if limit else report
+
+    def _keys(self, var, value):
+        """Resource-slot keys a session occupies with `value`, as in BacktrackingSolver._resource_keys."""
+        seq, room, inst = value
+        for slot_id in seq:
+            pos = self.slot_pos[slot_id]
+            yield ('i', inst.index, pos)
+            yield ('r', room.index, pos)
+            for sec in var.sections: yield ('s', sec.index, pos)
+
+    def _greedy_start(self):
+        # Occupants and the conflicted set are dicts keyed by var.index rather than
+        # sets of sessions, whose id-based hashes would make a seeded run irreproducible.
+        self._occupants, self._values, self._conflicted, self._total = {}, {}, {}, 0
+        order = sorted(self.variables, key=lambda v: (len(v.domain.timeslot_sequences) * len(v.domain.rooms), self.rng.random()))
+        for var in order:
+            self._place(var, self._min_conflicts_value(var))
+
+    def _place(self, var, value):
+        """Moves `var` to `value`, keeping occupancy, total conflicts and the conflicted set up to date."""
+        touched = []
+        old = self._values.get(var.index)
+        if old is not None:
+            for key in self._keys(var, old):
+                holders = self._occupants[key]
+                del holders[var.index]
+                if holders: self._total -= 1
+                touched.append(holders)
+        self._values[var.index] = value
+        for key in self._keys(var, value):
+            holders = self._occupants.setdefault(key, {})
+            if holders: self._total += 1
+            holders[var.index] = var
+            touched.append(holders)
+        for holders in touched:
+            for other in holders.values():
+                if self._in_conflict(other): self._conflicted[other.index] = other
+                else: self._conflicted.pop(other.index, None)
+        if not self._in_conflict(var): self._conflicted.pop(var.index, None)
+
+    def _in_conflict(self, var):
+        return any(len(self._occupants[key]) > 1 for key in self._keys(var, self._values[var.index]))
+
+    def _load(self, kind, label, pos, var):
+        """Sessions other than `var` holding a resource at a slot."""
+        holders = self._occupants.get((kind, label, pos))
+        if not holders: return 0
+        return len(holders) - (var.index in holders)
+
+    def _min_conflicts_value(self, var):
+        """
+        Value with the fewest clashes, ties broken at random. The cost splits
+        into section, instructor and room parts per sequence; candidates are
+        scanned in shuffled order so the search can stop at the first clash-free one.
+        """
+        d = var.domain
+        seqs = list(d.timeslot_sequences)
+        self.rng.shuffle(seqs)
+        best, best_cost = None, None
+        for seq in seqs:
+            positions = [self.slot_pos[slot_id] for slot_id in seq]
+            cost = sum(self._load('s', sec.index, pos, var) for sec in var.sections for pos in positions)
+            if best_cost is not None and cost >= best_cost: continue
+            inst, inst_cost = self._cheapest('i', [inst for inst in d.instructors if seq in d.allowed_sequences[inst.instructor_id]], positions, var)
+            if inst is None: continue
+            room, room_cost = self._cheapest('r', d.rooms, positions, var)
+            cost += inst_cost + room_cost
+            if best_cost is None or cost < best_cost:
+                best, best_cost = (seq, room, inst), cost
+                if not best_cost: break
+        return best
+
+    def _cheapest(self, kind, candidates, positions, var):
+        """Least loaded room or instructor among `candidates` (random among ties)."""
+        candidates = list(candidates)
+        self.rng.shuffle(candidates)
+        best, best_cost = None, None
+        for obj in candidates:
+            cost = sum(self._load(kind, obj.index, pos, var) for pos in positions)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = obj, cost
+                if not cost: break
+        return best, best_cost
+
+    def _random_value(self, var):
+        d = var.domain
+        inst = self.rng.choice([inst for inst in d.instructors if d.sequences_for(inst)])
+        return self.rng.choice(d.sequences_for(inst)), self.rng.choice(d.rooms), inst
+
+# Per-process context of PortfolioSolver / DecomposedSolver workers: the Phase 1
+# variables, the model and an optional stop event, handed over once by the pool
+# initializer so tasks only ship small descriptions and compact results.
+_PHASE1_CONTEXT = {}
+
+def _init_phase1_worker(variables, model_data, stop_event=None):
+    _PHASE1_CONTEXT['variables'] = variables
+    _PHASE1_CONTEXT['model_data'] = model_data
+    _PHASE1_CONTEXT['stop_event'] = stop_event
+
+def _encode_solution(solution):
+    """Four ints per assignment: session, sequence, room and instructor index."""
+    codes = []
+    for a in solution:
+        codes.extend((a.session.index, a.session.domain.sequence_index[tuple(a.timeslot_sequence)], a.room.index, a.instructor.index))
+    return codes
+
+def _decode_solution(codes, sessions, model_data, state):
+    """Rebuilds Assignments from _encode_solution output, adding them to `state`."""
+    rooms = list(model_data['rooms'].values())
+    instructors = list(model_data['instructors'].values())
+    solution = []
+    for base in range(0, len(codes), 4):
+        session = sessions[codes[base]]
+        assignment = Assignment(session, session.domain.timeslot_sequences[codes[base + 1]],
+                                rooms[codes[base + 2]], instructors[codes[base + 3]])
+        state.add_assignment(assignment)
+        solution.append(assignment)
+    return solution
+
+def _run_strategy(strategy, deadline):
+    """
+    Runs one portfolio strategy within whatever is left until `deadline` (a
+    time.time() value, or None for no limit). Returns (name, codes, nodes_visited, seconds,
+    stopped), where codes is the solution as four ints per assignment (session,
+    sequence, room, instructor index) or None if the strategy failed, and
+    stopped tells whether another strategy had already won.
+    """
+    options = dict(strategy)
+    name, engine = options.pop('name'), options.pop('engine', 'backtracking')
+    variables, model_data, stop_event = (_PHASE1_CONTEXT[k] for k in ('variables', 'model_data', 'stop_event'))
+    started = time.time()
+    time_limit = None if deadline is None else max(deadline - started, 0.0)
+    if engine == 'min_conflicts':
+        solver = MinConflictsSolver(variables, model_data, time_limit=30.0 if time_limit is None else time_limit, stop_event=stop_event, **options)
+        solution, _ = solver.solve()
+        nodes = solver.steps
+    else:
+        solver = BacktrackingSolver(variables, model_data, time_limit=time_limit, stop_event=stop_event, **options)
+        solution, _ = solver.solve()
+        nodes = solver.nodes_visited
+    codes = _encode_solution(solution) if solution else None
+    return name, codes, nodes, time.time() - started, stop_event.is_set()
+
+class PortfolioSolver:
+    """
+    Phase 1 race: runs several solver configurations in a process pool and
+    keeps the first feasible timetable. Each strategy is a dict with a 'name',
+    an optional 'engine' ('backtracking' or 'min_conflicts') and the keyword
+    arguments of that solver. Once a strategy succeeds the shared stop event
+    tells the others to give up and strategies not yet started are cancelled.
+    solve() returns (solution, state) like BacktrackingSolver; `winner` and
+    `nodes_visited` (search steps for min-conflicts) describe the strategy
+    that won and `results` lists every strategy that finished. All strategies
+    share one deadline, `time_limit` seconds after solve() starts.
+    """
+    DEFAULT_STRATEGIES = (
+        {'name': 'static'},
+        {'name': 'mrv', 'variable_ordering': 'mrv'},
+        {'name': 'mrv-cbj-luby', 'variable_ordering': 'mrv', 'backjumping': True, 'restart_policy': 'luby', 'seed': 1},
+        {'name': 'static-luby', 'restart_policy': 'luby', 'seed': 2},
+        {'name': 'forward-geometric', 'propagation': 'forward', 'restart_policy': 'geometric', 'seed': 3},
+        {'name': 'min-conflicts', 'engine': 'min_conflicts', 'seed': 4},
+    )
+
+    def __init__(self, variables, model_data, strategies=None, workers=None, time_limit=None):
+        self.variables = list(variables)
+        self.model_data = model_data
+        self.strategies = list(strategies or self.DEFAULT_STRATEGIES)
+        self.workers = workers or min(len(self.strategies), os.cpu_count() or 1)
+        self.time_limit = time_limit
+        self.winner = None
+        self.nodes_visited = 0
+        self.restarts = 0
+        self.budget_exhausted = False
+        self.results = []
+
+    def solve(self):
+        context = multiprocessing.get_context()
+        stop_event = context.Event()
+        winning_codes = None
+        deadline = None if self.time_limit is None else time.time() + self.time_limit
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_phase1_worker,
+                                 initargs=(self.variables, self.model_data, stop_event)) as pool:
+            futures = [pool.submit(_run_strategy, strategy, deadline) for strategy in self.strategies]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                try:
+                    name, codes, nodes, seconds, stopped = future.result()
+                except BaseException:
+                    stop_event.set()
+                    for other in futures: other.cancel()
+                    raise
+                self.results.append({'name': name, 'solved': codes is not None, 'stopped': stopped and codes is None,
+                                     'nodes_visited': nodes, 'seconds': seconds})
+                if codes is not None and winning_codes is None:
+                    self.winner, self.nodes_visited, winning_codes = name, nodes, codes
+                    stop_event.set()
+                    for other in futures: other.cancel()
+
+        if winning_codes is None:
+            self.budget_exhausted = self.time_limit is not None
+            return None, None
+        print(f"Portfolio winner: {self.winner} ({self.nodes_visited} nodes)")
+        state = TimetableState(self.model_data)
+        solution = _decode_solution(winning_codes, {var.index: var for var in self.variables}, self.model_data, state)
+        return solution, state
+
+def _solve_component(session_indices, reserved_rooms, reserved_instructors, options, deadline=None):
+    """
+    Solves the given sessions with the reserved rooms / instructors ((index,
+    slot mask) pairs) booked, within whatever is left until `deadline` (a
+    time.time() value) when the task starts. Returns (codes or None,
+    nodes_visited).
+    """
+    variables, model_data = _PHASE1_CONTEXT['variables'], _PHASE1_CONTEXT['model_data']
+    if deadline is not None:
+        options = dict(options, time_limit=max(deadline - time.time(), 0.0))
+    wanted = set(session_indices)
+    state = TimetableState(model_data)
+    state.reserve(reserved_rooms, reserved_instructors)
+    solver = BacktrackingSolver([var for var in variables if var.index in wanted], model_data, initial_state=state, **options)
+    solution, _ = solver.solve()
+    return (_encode_solution(solution) if solution else None), solver.nodes_visited
+
+class DecomposedSolver:
+    """
+    Phase 1 by decomposition. Sessions are linked in a constraint graph when
+    they share a section, a candidate instructor or a candidate room; the
+    connected components of that graph are solved concurrently in
+    `workers` processes, then merged.
+    Inside a component, sessions tied together by the `coupling` links
+    (sections by default, optionally instructors too) form clusters, and
+    every other shared resource is split slot by slot between the clusters
+    that can use it in proportion to their demand (see _reservations). A
+    cluster gets at most `cluster_nodes` search nodes per session under its
+    reservation; failed clusters are re-solved in the main process against
+    the merged timetable, and if that fails too the whole problem goes to a
+    single BacktrackingSolver. All tasks share one deadline, `time_limit`
+    seconds after solve() starts.
+    Extra keyword arguments are passed to every BacktrackingSolver.
+    """
+    LINKS = ('sections', 'instructors', 'rooms')
+
+    def __init__(self, variables, model_data, workers=None, coupling=('sections',), time_limit=None,
+                 cluster_nodes=50, **options):
+        if 'sections' not in coupling or not set(coupling) <= set(self.LINKS):
+            raise ValueError(f"coupling must include 'sections' and only use {self.LINKS}")
+        self.variables = list(variables)
+        self.model_data = model_data
+        self.workers = workers or os.cpu_count() or 1
+        self.coupling = tuple(coupling)
+        self.time_limit = time_limit
+        self.cluster_nodes = cluster_nodes
+        self.options = options
+        self.components = 0
+        self.clusters = 0
+        self.failed_clusters = 0
+        self.nodes_visited = 0
+        self.restarts = 0
+        self.budget_exhausted = False
+
+    def solve(self):
+        started = time.time()
+        loose = [kind for kind in self.LINKS if kind not in self.coupling]
+        tasks = []
+        components = self._components(self.variables, self.LINKS)
+        self.components = len(components)
+        for component in components:
+            clusters = self._components(component, self.coupling)
+            self.clusters += len(clusters)
+            if len(clusters) == 1:
+                tasks.append((component, (), ()))
+            else:
+                tasks.extend(zip(clusters, *self._reservations(clusters, loose)))
+
+        options = dict(self.options)
+        deadline = None if self.time_limit is None else started + self.time_limit
+        args = []
+        for cluster, rooms, insts in tasks:
+            task_options = options
+            if rooms or insts:
+                limit = self.cluster_nodes * len(cluster)
+                if options.get('node_limit') is not None: limit = min(limit, options['node_limit'])
+                task_options = dict(options, node_limit=limit)
+            args.append(([var.index for var in cluster], rooms, insts, task_options, deadline))
+        if len(args) > 1 and self.workers > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(args)), initializer=_init_phase1_worker,
+                                     initargs=(self.variables, self.model_data)) as pool:
+                results = list(pool.map(_solve_component, *zip(*args)))
+        else:
+            _init_phase1_worker(self.variables, self.model_data)
+            results = [_solve_component(*a) for a in args]
+
+        sessions = {var.index: var for var in self.variables}
+        state, solution, failed = TimetableState(self.model_data), [], []
+        for (cluster, _, _), (codes, nodes) in zip(tasks, results):
+            self.nodes_visited += nodes
+            if codes is None: failed.extend(cluster)
+            else: solution.extend(_decode_solution(codes, sessions, self.model_data, state))
+
+        if failed:
+            self.failed_clusters = sum(1 for _, (codes, _) in zip(tasks, results) if codes is None)
+            solution, state = self._repair(solution, state, failed, started)
+            if not solution:
+                return None, None
+        order = {var.index: i for i, var in enumerate(self.variables)}
+        solution.sort(key=lambda a: order[a.session.index])
+        print(f"Decomposition: {self.components} components, {self.clusters} clusters, {self.failed_clusters} re-solved")
+        return solution, state
+
+    def _remaining(self, started):
+        return None if self.time_limit is None else max(self.time_limit - (time.time() - started), 0.0)
+
+    def _repair(self, solution, state, failed, started):
+        """Re-solves failed clusters on top of the merged timetable, then the whole problem if needed."""
+        options = dict(self.options, time_limit=self._remaining(started))
+        solver = BacktrackingSolver(failed, self.model_data, initial_state=state, **options)
+        repaired, repaired_state = solver.solve()
+        self.nodes_visited += solver.nodes_visited
+        if repaired:
+            return solution + repaired, repaired_state
+        options['time_limit'] = self._remaining(started)
+        solver = BacktrackingSolver(self.variables, self.model_data, **options)
+        result = solver.solve()
+        self.nodes_visited += solver.nodes_visited
+        self.budget_exhausted = solver.budget_exhausted
+        return result
+
+    def _links(self, var, kind):
+        if kind == 'sections': return [('s', sec.index) for sec in var.sections]
+        if kind == 'instructors': return [('i', inst.index) for inst in var.domain.instructors]
+        return [('r', room.index) for room in var.domain.rooms]
+
+    def _components(self, variables, kinds):
+        """Connected components (largest first) of `variables` linked by the resources of `kinds`."""
+        parent = {}
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        for var in variables:
+            root = find(('v', var.index))
+            for kind in kinds:
+                for key in self._links(var, kind): parent[find(key)] = root
+        groups = {}
+        for var in variables: groups.setdefault(find(('v', var.index)), []).append(var)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def _reservations(self, clusters, kinds):
+        """
+        Shares out every resource of `kinds` wanted by several clusters, slot by
+        slot. Resources that are candidates of exactly the same Domains are
+        interchangeable and form a group; in each slot, the group's usable
+        resources are handed out in proportion to each
+        cluster's demand for the group, with the rounding carried over to the
+        next slots so that every cluster gets its share over the week. Each
+        cluster keeps the same run of resources while its count is unchanged,
+        which keeps rooms free in consecutive slots for longer sessions.
+        Returns, per cluster, the rooms and instructors reserved by the others
+        as (index, slot mask) pairs.
+        """
+        slots = sorted(self.model_data['timeslots'].values(), key=lambda slot: slot.index)
+        instructors = list(self.model_data['instructors'].values())
+        # Demand in slot units per resource and cluster; a session spreads its
+        # duration evenly over its candidates.
+        demand, domains = {}, {}
+        for kind in kinds:
+            for c, cluster in enumerate(clusters):
+                for var in cluster:
+                    keys = self._links(var, kind)
+                    for key in keys:
+                        per_cluster = demand.setdefault(key, {})
+                        per_cluster[c] = per_cluster.get(c, 0) + var.duration_slots / len(keys)
+                        domains.setdefault(key, set()).add(id(var.domain))
+        groups = {}
+        for key, per_cluster in demand.items():
+            if len(per_cluster) > 1: groups.setdefault((key[0], frozenset(domains[key])), []).append(key)
+
+        reserved = [([], []) for _ in clusters]
+        full = (1 << len(slots)) - 1
+        for (kind, _), keys in sorted(groups.items(), key=lambda item: min(item[1])):
+            keys.sort()
+            clients = sorted(demand[keys[0]])
+            need = {c: sum(demand[key][c] for key in keys) for c in clients}
+            total = sum(need.values())
+            credit = dict.fromkeys(clients, 0.0)
+            owned = {key: dict.fromkeys(clients, 0) for key in keys}
+            for slot in slots:
+                # An instructor is only worth sharing out where they can teach.
+                usable = [key for key in keys if kind != 'i' or slot.slot_id not in instructors[key[1]].not_preferred_slots]
+                counts = dict.fromkeys(clients, 0)
+                for c in clients: credit[c] += len(usable) * need[c] / total
+                for _ in usable:
+                    c = max(clients, key=lambda c: credit[c] - counts[c])
+                    counts[c] += 1
+                start = 0
+                for c in clients:
+                    for key in usable[start:start + counts[c]]: owned[key][c] |= 1 << slot.index
+                    start += counts[c]
+                    credit[c] -= counts[c]
+            for key in keys:
+                for c in clients:
+                    if owned[key][c] != full: reserved[c][kind == 'i'].append((key[1], full & ~owned[key][c]))
+        return [tuple(rooms) for rooms, _ in reserved], [tuple(insts) for _, insts in reserved]
+
+class PooledTimetableState(TimetableState):
+    """
+    TimetableState for a search that leaves rooms open. Assignments without a
+    room only count against their session's room pool (the distinct set of
+    candidate rooms of its domain): in every slot, the sessions whose pool
+    lies inside a pool Q may not outnumber the rooms in Q. These counting
+    bounds are necessary for a room assignment to exist, not sufficient.
+    Once Q is full its rooms are all spoken for, so they are marked busy in
+    slot_rooms (on top of the rooms actually booked or reserved there) and
+    room-aware checks (DomainMasks, contention) see them taken.
+    """
+    def __init__(self, model_data, variables):
+        super().__init__(model_data)
+        pools = {}
+        self.pool_of = {}
+        for var in variables:
+            key = frozenset(room.index for room in var.domain.rooms)
+            self.pool_of[id(var.domain)] = pools.setdefault(key, len(pools))
+        self.pool_sizes = [len(pool) for pool in pools]
+        self.pool_bits = [sum(1 << idx for idx in pool) for pool in pools]
+        self.pool_by_bits = {bits: p for p, bits in enumerate(self.pool_bits)}
+        self.supersets = [[q for q, other in enumerate(pools) if pool <= other] for pool in pools]
+        self.overlaps = [[q for q, other in enumerate(pools) if pool & other] for pool in pools]
+        # Per slot: sessions whose pool lies inside pool q, and sessions drawing on exactly pool q.
+        self.pool_load = [[0] * len(pools) for _ in self.slot_bit]
+        self.pool_count = [[0] * len(pools) for _ in self.slot_bit]
+        # Per slot: rooms of the full pools, kept apart from real bookings in slot_rooms.
+        self.pool_rooms = [0] * len(self.slot_bit)
+
+    def is_consistent(self, session, timeslot_sequence, room, instructor):
+        if room is not None:
+            return super().is_consistent(session, timeslot_sequence, room, instructor)
+        mask = self.sequence_mask(timeslot_sequence)
+        if self.instructor_masks[instructor.index] & mask:
+            return False
+        for section in session.sections:
+            if self.section_masks[section.index] & mask:
+                return False
+        supersets = self.supersets[self.pool_of[id(session.domain)]]
+        for pos in self.mask_positions(mask):
+            load = self.pool_load[pos]
+            for q in supersets:
+                if load[q] >= self.pool_sizes[q]: return False
+        return True
+
+    def room_contention(self, mask, room_bits):
+        """Room-free sessions competing for the pool `room_bits` in the busiest slot of `mask`."""
+        p = self.pool_by_bits.get(room_bits)
+        if p is None:
+            return super().room_contention(mask, room_bits)
+        return max(sum(self.pool_count[pos][q] for q in self.overlaps[p]) for pos in self.mask_positions(mask))
+
+    def add_assignment(self, assignment):
+        if assignment.room is not None:
+            return super().add_assignment(assignment)
+        self._book(assignment, 1)
+
+    def remove_assignment(self, assignment):
+        if assignment.room is not None:
+            super().remove_assignment(assignment)
+            for pos in self.mask_positions(self.sequence_mask(assignment.timeslot_sequence)):
+                self.slot_rooms[pos] |= self.pool_rooms[pos]
+            return
+        self._book(assignment, -1)
+
+    def _book(self, assignment, step):
+        mask = self.sequence_mask(assignment.timeslot_sequence)
+        inst_idx = assignment.instructor.index
+        pool = self.pool_of[id(assignment.session.domain)]
+        supersets = self.supersets[pool]
+        if step > 0:
+            self.instructor_masks[inst_idx] |= mask
+            for section in assignment.session.sections: self.section_masks[section.index] |= mask
+        else:
+            self.instructor_masks[inst_idx] &= ~mask
+            for section in assignment.session.sections: self.section_masks[section.index] &= ~mask
+        for pos in self.mask_positions(mask):
+            if step > 0: self.slot_instructors[pos] |= 1 << inst_idx
+            else: self.slot_instructors[pos] &= ~(1 << inst_idx)
+            self.pool_count[pos][pool] += step
+            load, full = self.pool_load[pos], False
+            for q in supersets:
+                full = full or load[q] >= self.pool_sizes[q]
+                load[q] += step
+                full = full or load[q] >= self.pool_sizes[q]
+            if full:
+                self._refresh_pool_rooms(pos)
+
+    def _refresh_pool_rooms(self, pos):
+        """Recomputes the full-pool rooms of slot `pos` and ORs them with its real room bookings."""
+        stale, bit = self.pool_rooms[pos], 1 << pos
+        booked = self.slot_rooms[pos] & ~stale
+        for room_idx in _iter_bits(stale):
+            if self.room_masks[room_idx] & bit: booked |= 1 << room_idx
+        rooms, load = 0, self.pool_load[pos]
+        for q, size in enumerate(self.pool_sizes):
+            if load[q] >= size: rooms |= self.pool_bits[q]
+        self.pool_rooms[pos] = rooms
+        self.slot_rooms[pos] = booked | rooms
+
+    def saturated_rooms(self, session, mask):
+        """Rooms of the pools around `session`'s pool that are full in some slot of `mask`."""
+        rooms = 0
+        for pos in self.mask_positions(mask):
+            load = self.pool_load[pos]
+            for q in self.supersets[self.pool_of[id(session.domain)]]:
+                if load[q] >= self.pool_sizes[q]: rooms |= self.pool_bits[q]
+        return rooms
+
+    def copy(self):
+        clone = super().copy()
+        clone.pool_load = [list(load) for load in self.pool_load]
+        clone.pool_count = [list(count) for count in self.pool_count]
+        clone.pool_rooms = list(self.pool_rooms)
+        return clone
+
+class RoomFreeSolver(BacktrackingSolver):
+    """
+    BacktrackingSolver that chooses only timeslot sequences and instructors:
+    every value has room None and rooms are checked by the counting bounds
+    of a PooledTimetableState. Pool overflows are not explained to the
+    conflict analysis, so backjumping is not available.
+    """
+    def __init__(self, variables, model_data, initial_state=None, **options):
+        if options.get('backjumping'):
+            raise ValueError("RoomFreeSolver does not support backjumping")
+        if initial_state is None:
+            initial_state = PooledTimetableState(model_data, variables)
+        super().__init__(variables, model_data, initial_state=initial_state, **options)
+
+    def _rooms_by_capacity(self, var):
+        return [(None, None, None)]
+
+    def _touched_rooms(self, assignment, mask):
+        return _iter_bits(self.state.saturated_rooms(assignment.session, mask))
+
+def _min_cost_matching(edges, capacity):
+    """
+    Minimum-cost maximum matching of left nodes to right nodes that each take
+    up to capacity[j] partners; edges[i] maps right node -> cost (>= 0).
+    Successive shortest paths from a super-source, with Dijkstra on costs
+    reduced by node potentials. Returns the right node per left node, None
+    where unmatched.
+    """
+    inf = float('inf')
+    n = len(edges)
+    sink = n + len(capacity)
+    match, load = [None] * n, [0] * len(capacity)
+    holders = [set() for _ in capacity]
+    potential = [0] * (sink + 1)  # left i, right n + j, sink
+    while True:
+        dist, parent = [inf] * (sink + 1), [None] * (sink + 1)
+        heap = []
+        for i in range(n):
+            if match[i] is None:
+                dist[i] = 0
+                heap.append((0, i))
+        heapq.heapify(heap)
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u] or u == sink: continue
+            if u < n:
+                arcs = [(n + j, cost) for j, cost in edges[u].items() if j != match[u]]
+            else:
+                j = u - n
+                arcs = [(k, -edges[k][j]) for k in holders[j]]
+                if load[j] < capacity[j]: arcs.append((sink, 0))
+            for v, cost in arcs:
+                reduced = d + cost + potential[u] - potential[v]
+                if reduced < dist[v]:
+                    dist[v], parent[v] = reduced, u
+                    heapq.heappush(heap, (reduced, v))
+        if dist[sink] == inf:
+            return match
+        for v in range(sink + 1):
+            if dist[v] < inf: potential[v] += dist[v]
+        j = parent[sink] - n
+        load[j] += 1
+        while True:
+            i = parent[n + j]
+            previous = match[i]
+            if previous is not None: holders[previous].discard(i)
+            match[i] = j
+            holders[j].add(i)
+            if parent[i] is None: break
+            j = parent[i] - n
+
+class TwoStageSolver:
+    """
+    Phase 1 in two stages. RoomFreeSolver first places every session in time
+    with an instructor, checking only that each slot leaves enough candidate
+    rooms. Rooms are then assigned in chronological order: the sessions
+    starting in a slot are matched to rooms free for their whole sequence by
+    a min-cost matching that avoids moving an instructor to another building
+    than their previous session that day, then wastes as few seats as
+    possible. The counting bounds do not guarantee a matching (a multi-slot
+    session keeps one room), so sessions left without a room are re-solved
+    by BacktrackingSolver around the matched ones, and the whole problem if
+    that fails too. Extra keyword arguments go to both searches.
+    """
+    BUILDING_CHANGE = 1000  # outweighs any seat difference
+
+    def __init__(self, variables, model_data, time_limit=None, **options):
+        self.variables = list(variables)
+        self.model_data = model_data
+        self.time_limit = time_limit
+        self.options = options
+        self.building_changes = 0
+        self.unmatched = 0
+        self.nodes_visited = 0
+        self.restarts = 0
+        self.budget_exhausted = False
+
+    def solve(self):
+        started = time.time()
+        stage1 = RoomFreeSolver(self.variables, self.model_data, time_limit=self.time_limit, **self.options)
+        timed, _ = stage1.solve()
+        self.nodes_visited, self.restarts = stage1.nodes_visited, stage1.restarts
+        if not timed:
+            self.budget_exhausted = stage1.budget_exhausted
+            return None, None
+        solution, state, unmatched = self._assign_rooms(timed)
+        self.unmatched = len(unmatched)
+        if unmatched:
+            solution, state = self._repair(solution, state, unmatched, started)
+            if not solution:
+                return None, None
+        order = {var.index: i for i, var in enumerate(self.variables)}
+        solution.sort(key=lambda a: order[a.session.index])
+        print(f"Two-stage: {self.building_changes} building changes, {self.unmatched} sessions re-solved")
+        return solution, state
+
+    def _assign_rooms(self, timed):
+        """Matches rooms slot by slot. Returns (solution, state, sessions left without a room)."""
+        state = TimetableState(self.model_data)
+        day_of = {slot.index: slot.day for slot in self.model_data['timeslots'].values()}
+        starts = {}
+        for a in timed:
+            first = state.mask_positions(state.sequence_mask(a.timeslot_sequence))[0]
+            starts.setdefault(first, []).append(a)
+        last_building = {}  # (instructor index, day) -> building of the latest session
+        solution, unmatched = [], []
+        for pos in sorted(starts):
+            batch = starts[pos]
+            groups, members, edges = {}, [], []
+            for a in batch:
+                mask = state.sequence_mask(a.timeslot_sequence)
+                previous = last_building.get((a.instructor.index, day_of[pos]))
+                costs = {}
+                for room, room_class in zip(a.session.domain.rooms, a.session.domain.room_classes):
+                    occupancy = state.room_masks[room.index]
+                    if occupancy & mask: continue
+                    # Rooms of one class with the same occupancy are interchangeable.
+                    g = groups.get((room_class, occupancy))
+                    if g is None:
+                        g = groups[(room_class, occupancy)] = len(members)
+                        members.append(set())
+                    members[g].add(room)
+                    if g not in costs:
+                        moved = previous is not None and previous != room.room_id.split()[0]
+                        costs[g] = self.BUILDING_CHANGE * moved + room.capacity - a.session.total_student_count
+                edges.append(costs)
+            pool = [sorted(rooms, key=lambda r: r.index) for rooms in members]
+            for a, g in zip(batch, _min_cost_matching(edges, [len(rooms) for rooms in pool])):
+                if g is None:
+                    unmatched.append(a.session)
+                    continue
+                room = pool[g].pop()
+                building, key = room.room_id.split()[0], (a.instructor.index, day_of[pos])
+                if last_building.get(key, building) != building: self.building_changes += 1
+                last_building[key] = building
+                assignment = Assignment(a.session, a.timeslot_sequence, room, a.instructor)
+                state.add_assignment(assignment)
+                solution.append(assignment)
+        return solution, state, unmatched
+
+    def _remaining(self, started):
+        return None if self.time_limit is None else max(self.time_limit - (time.time() - started), 0.0)
+
+    def _repair(self, solution, state, unmatched, started):
+        """Re-solves unmatched sessions on top of the matched timetable, then the whole problem if needed."""
+        options = dict(self.options, time_limit=self._remaining(started))
+        solver = BacktrackingSolver(unmatched, self.model_data, initial_state=state, **options)
+        repaired, repaired_state = solver.solve()
+        self.nodes_visited += solver.nodes_visited
+        if repaired:
+            return solution + repaired, repaired_state
+        options['time_limit'] = self._remaining(started)
+        solver = BacktrackingSolver(self.variables, self.model_data, **options)
+        result = solver.solve()
+        self.nodes_visited += solver.nodes_visited
+        self.budget_exhausted = solver.budget_exhausted
+        return result
+
 class CostEvaluator:
+    """
+    Soft-constraint cost of a timetable. A section's occupancy on one day is
+    encoded as a small integer pattern (bit i is the day's i-th slot), and the
+    gap penalty and load of every pattern come from per-day tables built once
+    for the weights, as do the bad-time penalty per slot and the building of
+    every room.
+    """
+    PATTERN_TABLE_LIMIT = 12  # days with at most this many slots get every pattern tabulated up front
+
     def __init__(self, model_data, weights=None):
         self.model_data = model_data
         self.weights = weights if weights else DEFAULT_OPTIMIZATION_WEIGHTS
@@ -392,6 +1983,21 @@ class CostEvaluator:
             if slot.day not in self.slots_by_day: self.slots_by_day[slot.day] = []
             self.slots_by_day[slot.day].append(slot.slot_id)
         for d in self.slots_by_day: self.slots_by_day[d].sort()
+        self.slot_day = {slot.slot_id: slot.day for slot in model_data['timeslots'].values()}
+
+        self.slot_penalty = {slot_id: self.weights["bad_time_penalty"] if slot_id in self.early_late_slots else 0
+                             for slot_id in self.slot_day}
+        self.day_slots = list(self.slots_by_day.values())
+        # slot_id -> (day number, bit of the slot in that day's pattern)
+        self.slot_pattern = {slot_id: (d, 1 << i) for d, slot_ids in enumerate(self.day_slots) for i, slot_id in enumerate(slot_ids)}
+        # Per day: pattern -> (gap penalty, slots used)
+        self.pattern_tables = []
+        for slot_ids in self.day_slots:
+            table = {}
+            if len(slot_ids) <= self.PATTERN_TABLE_LIMIT:
+                for pattern in range(1 << len(slot_ids)): table[pattern] = self._score_pattern(slot_ids, pattern)
+            self.pattern_tables.append(table)
+        self.room_building = {room.index: room.room_id.split()[0] for room in model_data['rooms'].values()}
 
     def calculate_total_cost(self, solution, state):
         total_penalty = 0
@@ -401,178 +2007,1249 @@ class CostEvaluator:
             inst_id = assignment.instructor.instructor_id
             if inst_id not in inst_assignments: inst_assignments[inst_id] = []
             inst_assignments[inst_id].append(assignment)
-            
-            for slot_id in assignment.timeslot_sequence:
-                if slot_id in self.early_late_slots:
-                    total_penalty += self.weights["bad_time_penalty"]
+            total_penalty += self._time_cost(assignment.timeslot_sequence)
 
         for inst_id, assigns in inst_assignments.items():
-            assigns.sort(key=lambda a: a.timeslot_sequence[0])
-            for i in range(len(assigns) - 1):
-                curr = assigns[i]
-                next_a = assigns[i+1]
-                curr_day = self.model_data['timeslots'][curr.timeslot_sequence[0]].day
-                next_day = self.model_data['timeslots'][next_a.timeslot_sequence[0]].day
-                
-                if curr_day == next_day:
-                    b1 = curr.room.room_id.split()[0]
-                    b2 = next_a.room.room_id.split()[0]
-                    if b1 != b2:
-                        total_penalty += self.weights["building_change_penalty"]
+            total_penalty += self._instructor_cost(assigns)
 
         for section in self.model_data['sections'].values():
-            sec_schedule = state.section_schedule[section.section_id]
-            total_penalty += self._calculate_gaps(sec_schedule)
-            
-            daily_load = []
-            for day, day_slots in self.slots_by_day.items():
-                hours = sum(1 for s in day_slots if s in sec_schedule)
-                daily_load.append(hours)
-            
-            if daily_load:
-                load_imbalance = max(daily_load) - min(daily_load)
-                if load_imbalance > 3:
-                    total_penalty += (load_imbalance * self.weights["daily_load_imbalance"])
+            total_penalty += self._section_cost(state.section_slots(section.section_id))
 
         return total_penalty
 
-    def _calculate_gaps(self, busy_slots):
+    def penalty_breakdown(self, solution, state):
+        """
+        Where the cost of a timetable comes from: {'sessions': bad-time penalty
+        per session_id, 'instructors': building changes per instructor_id,
+        'sections': gaps and load imbalance per section_id}. The parts add up
+        to calculate_total_cost; entities without penalty are left out.
+        """
+        sessions, instructors, sections = {}, {}, {}
+        inst_assignments = {}
+        for assignment in solution:
+            inst_assignments.setdefault(assignment.instructor.instructor_id, []).append(assignment)
+            cost = self._time_cost(assignment.timeslot_sequence)
+            if cost: sessions[assignment.session.session_id] = cost
+        for inst_id, assigns in inst_assignments.items():
+            cost = self._instructor_cost(assigns)
+            if cost: instructors[inst_id] = cost
+        for section in self.model_data['sections'].values():
+            cost = self._section_cost(state.section_slots(section.section_id))
+            if cost: sections[section.section_id] = cost
+        return {'sessions': sessions, 'instructors': instructors, 'sections': sections}
+
+    def _time_cost(self, timeslot_sequence):
+        slot_penalty = self.slot_penalty
+        return sum(slot_penalty[slot_id] for slot_id in timeslot_sequence)
+
+    def _instructor_cost(self, assigns):
+        penalty = 0
+        assigns = sorted(assigns, key=lambda a: a.timeslot_sequence[0])
+        for i in range(len(assigns) - 1):
+            curr = assigns[i]
+            next_a = assigns[i+1]
+            curr_day = self.slot_day[curr.timeslot_sequence[0]]
+            next_day = self.slot_day[next_a.timeslot_sequence[0]]
+            
+            if curr_day == next_day:
+                if self.room_building[curr.room.index] != self.room_building[next_a.room.index]:
+                    penalty += self.weights["building_change_penalty"]
+        return penalty
+
+    def day_patterns(self, slots):
+        """Per-day occupancy patterns of a set of slot IDs."""
+        patterns = [0] * len(self.day_slots)
+        for slot_id in slots:
+            d, bit = self.slot_pattern[slot_id]
+            patterns[d] |= bit
+        return patterns
+
+    def _section_cost(self, sec_schedule):
+        return self._pattern_cost(self.day_patterns(sec_schedule))
+
+    def _pattern_cost(self, patterns):
+        penalty, lo, hi = 0, None, None
+        for d, pattern in enumerate(patterns):
+            gaps, load = self._lookup_pattern(d, pattern)
+            penalty += gaps
+            if lo is None or load < lo: lo = load
+            if hi is None or load > hi: hi = load
+        if lo is not None:
+            load_imbalance = hi - lo
+            if load_imbalance > 3:
+                penalty += (load_imbalance * self.weights["daily_load_imbalance"])
+        return penalty
+
+    def _lookup_pattern(self, d, pattern):
+        table = self.pattern_tables[d]
+        entry = table.get(pattern)
+        if entry is None:
+            entry = table[pattern] = self._score_pattern(self.day_slots[d], pattern)
+        return entry
+
+    def _score_pattern(self, slot_ids, pattern):
+        day_busy = [slot_ids[i] for i in _iter_bits(pattern)]
         gap_penalty = 0
-        if not busy_slots: return 0
-        for day, slot_ids_in_day in self.slots_by_day.items():
-            day_busy = [s for s in slot_ids_in_day if s in busy_slots]
-            day_busy.sort()
-            for i in range(len(day_busy) - 1):
-                gap = day_busy[i+1] - day_busy[i]
-                if gap == 2: gap_penalty += self.weights["gap_penalty"]
-                elif gap == 3: gap_penalty += (self.weights["gap_penalty"] * 3)
-                elif gap > 3: gap_penalty += (self.weights["gap_penalty"] * 5)
-        return gap_penalty
+        for i in range(len(day_busy) - 1):
+            gap = day_busy[i+1] - day_busy[i]
+            if gap == 2: gap_penalty += self.weights["gap_penalty"]
+            elif gap == 3: gap_penalty += (self.weights["gap_penalty"] * 3)
+            elif gap > 3: gap_penalty += (self.weights["gap_penalty"] * 5)
+        return gap_penalty, len(day_busy)
+
+class IncrementalCostEvaluator:
+    """
+    Delta evaluation on top of CostEvaluator. Keeps the penalty contributed by
+    every instructor, section, session and timeslot so that a swap or move only
+    rescores the entities it touches. total_cost always equals
+    calculate_total_cost.
+    """
+    def __init__(self, evaluator, solution):
+        self.evaluator = evaluator
+        self.session_cost = {a.session.index: evaluator._time_cost(a.timeslot_sequence) for a in solution}
+        self.inst_assignments = {}
+        self.section_slots = {sec.index: set() for sec in evaluator.model_data['sections'].values()}
+        self.slot_usage = {}
+        for assignment in solution:
+            self.inst_assignments.setdefault(assignment.instructor.index, {})[assignment.session.index] = assignment
+            for slot_id in assignment.timeslot_sequence:
+                self.slot_usage[slot_id] = self.slot_usage.get(slot_id, 0) + 1
+                for section in assignment.session.sections:
+                    self.section_slots[section.index].add(slot_id)
+
+        self.inst_cost = {inst_idx: evaluator._instructor_cost(list(assigns.values())) for inst_idx, assigns in self.inst_assignments.items()}
+        self.section_cost = {sec_idx: evaluator._section_cost(slots) for sec_idx, slots in self.section_slots.items()}
+        self.slot_cost = {slot_id: evaluator._time_cost([slot_id]) * count for slot_id, count in self.slot_usage.items()}
+        self.total_cost = sum(self.inst_cost.values()) + sum(self.section_cost.values()) + sum(self.slot_cost.values())
+        self._pending = None
+
+    def delta(self, removed, added):
+        """
+        Cost change of replacing the `removed` assignments with `added`.
+        Nothing is changed until commit() is called.
+        """
+        ev = self.evaluator
+        delta = 0
+        for a in removed: delta -= ev._time_cost(a.timeslot_sequence)
+        for a in added: delta += ev._time_cost(a.timeslot_sequence)
+
+        new_inst = {}
+        for inst_idx in {a.instructor.index for a in removed} | {a.instructor.index for a in added}:
+            assigns = dict(self.inst_assignments.get(inst_idx, {}))
+            for a in removed:
+                if a.instructor.index == inst_idx: del assigns[a.session.index]
+            for a in added:
+                if a.instructor.index == inst_idx: assigns[a.session.index] = a
+            cost = ev._instructor_cost(list(assigns.values()))
+            new_inst[inst_idx] = (assigns, cost)
+            delta += cost - self.inst_cost.get(inst_idx, 0)
+
+        new_sections = {}
+        for sec_idx in {s.index for a in removed + added for s in a.session.sections}:
+            slots = set(self.section_slots[sec_idx])
+            for a in removed:
+                if any(s.index == sec_idx for s in a.session.sections): slots.difference_update(a.timeslot_sequence)
+            for a in added:
+                if any(s.index == sec_idx for s in a.session.sections): slots.update(a.timeslot_sequence)
+            cost = ev._section_cost(slots)
+            new_sections[sec_idx] = (slots, cost)
+            delta += cost - self.section_cost[sec_idx]
+
+        self._pending = (removed, added, new_inst, new_sections, delta)
+        return delta
+
+    def commit(self):
+        """Applies the change scored by the last call to delta()."""
+        removed, added, new_inst, new_sections, delta = self._pending
+        for a in removed:
+            for slot_id in a.timeslot_sequence: self._bump_slot(slot_id, -1)
+            self.session_cost.pop(a.session.index, None)
+        for a in added:
+            for slot_id in a.timeslot_sequence: self._bump_slot(slot_id, 1)
+            self.session_cost[a.session.index] = self.evaluator._time_cost(a.timeslot_sequence)
+        for inst_idx, (assigns, cost) in new_inst.items():
+            self.inst_assignments[inst_idx], self.inst_cost[inst_idx] = assigns, cost
+        for sec_idx, (slots, cost) in new_sections.items():
+            self.section_slots[sec_idx], self.section_cost[sec_idx] = slots, cost
+        self.total_cost += delta
+        self._pending = None
+        return self.total_cost
+
+    def apply(self, removed, added):
+        self.delta(removed, added)
+        return self.commit()
+
+    def breakdown(self):
+        """The live counterpart of CostEvaluator.penalty_breakdown, keyed by entity index."""
+        return {'sessions': {idx: cost for idx, cost in self.session_cost.items() if cost},
+                'instructors': {idx: cost for idx, cost in self.inst_cost.items() if cost},
+                'sections': {idx: cost for idx, cost in self.section_cost.items() if cost}}
+
+    def verify(self, solution, state):
+        """True if the incremental total agrees with a full recalculation."""
+        return self.total_cost == self.evaluator.calculate_total_cost(solution, state)
+
+    def _bump_slot(self, slot_id, step):
+        self.slot_usage[slot_id] = self.slot_usage.get(slot_id, 0) + step
+        self.slot_cost[slot_id] = self.evaluator._time_cost([slot_id]) * self.slot_usage[slot_id]
+
+class PenaltySampler:
+    """
+    Draws solution positions with probability proportional to the penalty a
+    session is involved in, read from an IncrementalCostEvaluator: its own
+    bad-time cost plus an equal share of the cost of each of its sections and
+    of its instructor, plus `floor` so that every session stays reachable.
+    Weights sit in a Fenwick tree, so sample() and the refresh() after a
+    committed move cost O(log n) per session touched.
+    """
+    def __init__(self, incremental, solution, floor=1.0, rng=random):
+        self.incremental = incremental
+        self.floor = floor
+        self.rng = rng
+        self.size = len(solution)
+        self.positions = {a.session.index: i for i, a in enumerate(solution)}
+        self.sections = {a.session.index: [sec.index for sec in a.session.sections] for a in solution}
+        self.instructor_of = {a.session.index: a.instructor.index for a in solution}
+        self.section_sessions = {}
+        for a in solution:
+            for sec in a.session.sections: self.section_sessions.setdefault(sec.index, []).append(a.session.index)
+        self.weights = [0.0] * self.size
+        self.tree = [0.0] * (self.size + 1)
+        self.total = 0.0
+        self._top = 1 << (self.size.bit_length() - 1) if self.size else 0
+        for s in self.positions: self._update(s)
+
+    def weight(self, s):
+        inc = self.incremental
+        w = self.floor + inc.session_cost.get(s, 0)
+        for sec_idx in self.sections[s]:
+            w += inc.section_cost[sec_idx] / len(self.section_sessions[sec_idx])
+        inst_idx = self.instructor_of[s]
+        w += inc.inst_cost.get(inst_idx, 0) / max(1, len(inc.inst_assignments.get(inst_idx, ())))
+        return w
+
+    def refresh(self, removed, added):
+        """Re-weights every session sharing a section or instructor with a committed move."""
+        touched = set()
+        for a in removed + added:
+            touched.update(self.incremental.inst_assignments.get(a.instructor.index, ()))
+            for sec in a.session.sections: touched.update(self.section_sessions[sec.index])
+        for a in added:
+            self.instructor_of[a.session.index] = a.instructor.index
+        for s in touched: self._update(s)
+
+    def sample(self):
+        """A solution position drawn by weight."""
+        target = self.rng.random() * self.total
+        pos, step = 0, self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] < target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+    def _update(self, s):
+        i = self.positions[s]
+        w = self.weight(s)
+        change = w - self.weights[i]
+        if not change: return
+        self.weights[i] = w
+        self.total += change
+        i += 1
+        while i <= self.size:
+            self.tree[i] += change
+            i += i & -i
+
+class Move:
+    """
+    Replaces `old` assignments with `new` ones directly on the live solution and
+    state. The solution list is addressed through a session index -> position map.
+    An optional `by_sequence` index (timeslot sequence -> {session index:
+    assignment}) is kept in step with the solution.
+    """
+    def __init__(self, old, new):
+        self.old, self.new = old, new
+
+    @staticmethod
+    def reindex(by_sequence, removed, added):
+        """Moves `removed` out of and `added` into a by_sequence index."""
+        if by_sequence is None: return
+        for a in removed: del by_sequence[tuple(a.timeslot_sequence)][a.session.index]
+        for a in added: by_sequence.setdefault(tuple(a.timeslot_sequence), {})[a.session.index] = a
+
+    def try_apply(self, solution, state, positions, by_sequence=None):
+        """Applies the move if every new assignment fits, otherwise leaves everything untouched."""
+        for a in self.old: state.remove_assignment(a)
+        placed = []
+        for a in self.new:
+            if not state.is_consistent(a.session, a.timeslot_sequence, a.room, a.instructor):
+                for p in placed: state.remove_assignment(p)
+                for o in self.old: state.add_assignment(o)
+                return False
+            state.add_assignment(a)
+            placed.append(a)
+        for a in self.new: solution[positions[a.session.index]] = a
+        self.reindex(by_sequence, self.old, self.new)
+        return True
+
+    def undo(self, solution, state, positions, by_sequence=None):
+        for a in self.new: state.remove_assignment(a)
+        for a in self.old:
+            state.add_assignment(a)
+            solution[positions[a.session.index]] = a
+        self.reindex(by_sequence, self.new, self.old)
+
+class BatchMoveEvaluator:
+    """
+    NumPy mirror of a timetable for scoring many relocation moves at once.
+    Occupancy is held as boolean section x slot, instructor x slot and
+    room x slot matrices, every section's week as per-day patterns (see
+    CostEvaluator) and every instructor's day as the building id of the
+    session starting in each slot. propose() draws a batch of moves that put
+    a session on another timeslot sequence and room with the same
+    instructor, then checks the hard constraints and computes the
+    CostEvaluator delta of all of them with array operations. The mirror is
+    kept in sync by calling apply() for every committed move.
+    """
+    def __init__(self, evaluator, solution, state, seed=None):
+        ev = self.evaluator = evaluator
+        model_data = evaluator.model_data
+        self.rng = np.random.default_rng(seed)
+        self.state = state
+        slots = sorted(model_data['timeslots'].values(), key=lambda slot: slot.index)
+        n_slots, n_days = len(slots), len(ev.day_slots)
+        width = max(len(slot_ids) for slot_ids in ev.day_slots)
+        if width > ev.PATTERN_TABLE_LIMIT:
+            raise ValueError(f"BatchMoveEvaluator needs at most {ev.PATTERN_TABLE_LIMIT} slots per day, got {width}")
+        self.slot_penalty = np.array([ev.slot_penalty[slot.slot_id] for slot in slots])
+        self.slot_day = np.array([ev.slot_pattern[slot.slot_id][0] for slot in slots])
+        self.gap_table = np.array([[ev._lookup_pattern(d, p)[0] if p < 1 << len(slot_ids) else 0 for p in range(1 << width)]
+                                   for d, slot_ids in enumerate(ev.day_slots)])
+        self.load_table = np.array([_popcount(p) for p in range(1 << width)])
+        self.weights = ev.weights
+        self.instructors = list(model_data['instructors'].values())
+        buildings = {}
+        self.room_building = np.array([buildings.setdefault(ev.room_building[idx], len(buildings))
+                                       for idx in range(len(ev.room_building))])
+
+        # Every distinct timeslot sequence gets a global id.
+        self.sequence_ids, self.sequences, seq_slots, seq_days = {}, [], [], []
+        self.sessions, self.domain_rooms, self.options = {}, {}, {}
+        for a in solution:
+            session = a.session
+            self.sessions[session.index] = session
+            for seq in session.domain.timeslot_sequences:
+                if seq in self.sequence_ids: continue
+                self.sequence_ids[seq] = len(self.sequences)
+                self.sequences.append(seq)
+                mask = state.sequence_mask(seq)
+                seq_slots.append([bool(mask >> pos & 1) for pos in range(n_slots)])
+                patterns = [0] * n_days
+                for slot_id in seq:
+                    d, bit = ev.slot_pattern[slot_id]
+                    patterns[d] |= bit
+                seq_days.append(patterns)
+        self.seq_slots = np.array(seq_slots, dtype=bool).reshape(len(self.sequences), n_slots)
+        self.seq_patterns = np.array(seq_days, dtype=np.int64).reshape(len(self.sequences), n_days)
+        self.seq_start = self.seq_slots.argmax(axis=1)
+        self.session_ids = np.array(sorted(self.sessions))
+
+        n_sessions = max(self.sessions, default=-1) + 1
+        width = max((len(s.sections) for s in self.sessions.values()), default=1)
+        self.session_sections = np.full((n_sessions, width), -1)
+        for idx, session in self.sessions.items():
+            self.session_sections[idx, :len(session.sections)] = [sec.index for sec in session.sections]
+        self.current_seq = np.zeros(n_sessions, dtype=np.int64)
+        self.current_room = np.zeros(n_sessions, dtype=np.int64)
+        self.current_inst = np.zeros(n_sessions, dtype=np.int64)
+
+        n_sections = len(model_data['sections'])
+        self.section_occ = np.zeros((n_sections, n_slots), dtype=bool)
+        self.instructor_occ = np.zeros((len(model_data['instructors']), n_slots), dtype=bool)
+        self.room_occ = np.zeros((len(model_data['rooms']), n_slots), dtype=bool)
+        self.section_patterns = np.zeros((n_sections, n_days), dtype=np.int64)
+        self.section_cost = np.zeros(n_sections, dtype=np.int64)
+        self.start_building = np.full((len(model_data['instructors']), n_slots), -1)
+        self.apply([], solution)
+
+    def apply(self, removed, added):
+        """Mirrors a committed move: `removed` assignments are replaced by `added` ones."""
+        touched = set()
+        for a in removed: touched.update(self._book(a, False))
+        for a in added: touched.update(self._book(a, True))
+        for sec_idx in touched:
+            self.section_cost[sec_idx] = self.evaluator._pattern_cost([int(p) for p in self.section_patterns[sec_idx]])
+
+    def _book(self, a, on):
+        gid = self.sequence_ids[tuple(a.timeslot_sequence)]
+        slots = self.seq_slots[gid]
+        inst_idx, room_idx = a.instructor.index, a.room.index
+        self.instructor_occ[inst_idx, slots] = on
+        self.room_occ[room_idx, slots] = on
+        self.start_building[inst_idx, self.seq_start[gid]] = self.room_building[room_idx] if on else -1
+        sections = [sec.index for sec in a.session.sections]
+        for sec_idx in sections:
+            self.section_occ[sec_idx, slots] = on
+            if on: self.section_patterns[sec_idx] |= self.seq_patterns[gid]
+            else: self.section_patterns[sec_idx] &= ~self.seq_patterns[gid]
+        if on:
+            s = a.session.index
+            self.current_seq[s], self.current_room[s], self.current_inst[s] = gid, room_idx, inst_idx
+        return sections
+
+    def _choices(self, s):
+        """Sequence ids allowed to session `s` with its current instructor, and its room indices."""
+        key = (s, int(self.current_inst[s]))
+        choices = self.options.get(key)
+        if choices is None:
+            session = self.sessions[s]
+            inst_id = self.instructors[key[1]].instructor_id
+            seqs = [self.sequence_ids[seq] for seq in session.domain.timeslot_sequences
+                    if seq in session.domain.allowed_sequences[inst_id]]
+            choices = self.options[key] = (seqs, [room.index for room in session.domain.rooms])
+        return choices
+
+    def propose(self, size, sessions=None):
+        """
+        Draws `size` relocation moves, of the given session indices or of
+        uniformly drawn ones. Returns (session, sequence id, room index,
+        valid, delta) arrays; delta is the exact cost change of each valid
+        move.
+        """
+        if sessions is None:
+            sessions = self.session_ids[self.rng.integers(0, len(self.session_ids), size)]
+        else:
+            sessions = np.asarray(sessions, dtype=np.int64)
+        picks = self.rng.random((size, 2))
+        new_seq = np.empty(size, dtype=np.int64)
+        new_room = np.empty(size, dtype=np.int64)
+        for c, s in enumerate(sessions):
+            seqs, rooms = self._choices(s)
+            new_seq[c] = seqs[int(picks[c, 0] * len(seqs))]
+            new_room[c] = rooms[int(picks[c, 1] * len(rooms))]
+        old_seq, old_room, inst = self.current_seq[sessions], self.current_room[sessions], self.current_inst[sessions]
+        new_slots, old_slots = self.seq_slots[new_seq], self.seq_slots[old_seq]
+
+        # Hard constraints, with the moved session's own slots freed first.
+        free_own = ~old_slots
+        room_clash = self.room_occ[new_room] & new_slots & (free_own | (old_room != new_room)[:, None])
+        inst_clash = self.instructor_occ[inst] & new_slots & free_own
+        sections = self.session_sections[sessions]
+        has_section = sections >= 0
+        sec_rows = sections.clip(0)
+        sec_clash = self.section_occ[sec_rows] & (new_slots & free_own)[:, None, :] & has_section[:, :, None]
+        valid = ~(room_clash.any(axis=1) | inst_clash.any(axis=1) | sec_clash.any(axis=(1, 2)))
+
+        delta = (new_slots.astype(np.int64) - old_slots) @ self.slot_penalty
+        delta += self._section_delta(sec_rows, has_section, old_seq, new_seq)
+        delta += self.weights["building_change_penalty"] * self._building_delta(inst, old_seq, old_room, new_seq, new_room)
+        return sessions, new_seq, new_room, valid, delta
+
+    def _section_delta(self, sections, has_section, old_seq, new_seq):
+        patterns = self.section_patterns[sections] & ~self.seq_patterns[old_seq][:, None, :] | self.seq_patterns[new_seq][:, None, :]
+        days = np.arange(patterns.shape[-1])
+        gaps = self.gap_table[days, patterns].sum(axis=-1)
+        loads = self.load_table[patterns]
+        imbalance = loads.max(axis=-1) - loads.min(axis=-1)
+        cost = gaps + np.where(imbalance > 3, imbalance * self.weights["daily_load_imbalance"], 0)
+        return ((cost - self.section_cost[sections]) * has_section).sum(axis=1)
+
+    def _building_delta(self, inst, old_seq, old_room, new_seq, new_room):
+        """Change in same-day building changes of each moved session's instructor."""
+        rows = self.start_building[inst].copy()
+        batch = np.arange(len(inst))
+        old_start, new_start = self.seq_start[old_seq], self.seq_start[new_seq]
+        rows[batch, old_start] = -1
+        return (self._changes(rows, new_start, self.room_building[new_room])
+                - self._changes(rows, old_start, self.room_building[old_room]))
+
+    def _changes(self, rows, start, building):
+        """Building changes added by a session in `building` starting at `start` between its same-day neighbours in `rows`."""
+        n_slots = rows.shape[1]
+        grid = np.arange(n_slots)[None, :]
+        same_day = (rows >= 0) & (self.slot_day[None, :] == self.slot_day[start][:, None])
+        prev = np.where(same_day & (grid < start[:, None]), grid, -1).max(axis=1)
+        nxt = np.where(same_day & (grid > start[:, None]), grid, n_slots).min(axis=1)
+        batch = np.arange(len(start))
+        before = np.where(prev >= 0, rows[batch, prev.clip(0)], -1)
+        after = np.where(nxt < n_slots, rows[batch, nxt.clip(max=n_slots - 1)], -1)
+        return (((before >= 0) & (before != building)).astype(np.int64) + ((after >= 0) & (after != building))
+                - ((before >= 0) & (after >= 0) & (before != after)))
 
 class SimulatedAnnealingSolver:
-    def __init__(self, solution, state, evaluator, model_data, iterations=50000, initial_temp=10.0, cooling_rate=0.9995, progress_callback=None):
-        self.current_solution = solution
+    """
+    Phase 2 simulated annealing. Every step draws a move type with
+    probability proportional to `move_weights` (default MOVE_WEIGHTS):
+    'swap' (two sessions with the same Domain trade time, room and instructor),
+    'move' (new time and room), 'room', 'instructor' (another candidate
+    allowed at the same time), 'kempe' (Kempe chain between two timeslot
+    sequences) and 'day_swap' (one section's sessions on two days trade
+    places). Candidates are sampled, at most MOVE_SAMPLES per step, instead
+    of enumerated. move_stats counts, per type, the steps that drew it, the
+    moves that could be applied and the ones accepted. When `guided`, the
+    sessions a move starts from are drawn by a PenaltySampler, so moves
+    mostly touch sessions that carry penalty.
+
+    With `batch_size`, move neighbours come from a BatchMoveEvaluator that
+    scores that many relocations at once; `batch_policy` then proposes the
+    cheapest valid one ('best') or one drawn with probability proportional
+    to its Metropolis acceptance ('metropolis'), which still has to pass the
+    usual acceptance test. A batch counts as one iteration. Timetables the
+    BatchMoveEvaluator cannot mirror fall back to single moves (batch None).
+
+    The schedule is geometric cooling from `initial_temp` by default. With
+    `target_acceptance`, optimize() first sets the temperature so that the
+    average uphill move of a sample is accepted with that probability. With
+    `adaptive`, cooling runs twice as fast while more than ADAPT_HIGH of the
+    last ADAPT_WINDOW uphill moves were accepted and pauses below ADAPT_LOW.
+    After `reheat_after` steps without a new best the temperature goes back
+    up to REHEAT_FACTOR times the one at which the best solution was found,
+    at most `initial_temp` (never down); after `patience` steps without a new
+    best, or `time_limit` seconds, the run stops early (stop_reason).
+    """
+    MOVE_WEIGHTS = {'swap': 0.3, 'move': 0.3, 'room': 0.1, 'instructor': 0.1, 'kempe': 0.1, 'day_swap': 0.1}
+    MOVE_SAMPLES = 20
+    KEMPE_LIMIT = 8
+    CALIBRATION_SAMPLES = 200
+    ADAPT_WINDOW, ADAPT_HIGH, ADAPT_LOW = 100, 0.5, 0.01
+    REHEAT_FACTOR = 2.0
+
+    def __init__(self, solution, state, evaluator, model_data, iterations=50000, initial_temp=10.0, cooling_rate=0.9995, progress_callback=None,
+                 batch_size=None, batch_policy='best', move_weights=None, guided=True, target_acceptance=None,
+                 adaptive=False, reheat_after=None, patience=None, time_limit=None):
+        if batch_policy not in ('best', 'metropolis'):
+            raise ValueError(f"Unknown batch policy: {batch_policy}")
+        move_weights = dict(move_weights if move_weights is not None else self.MOVE_WEIGHTS)
+        if not set(move_weights) <= set(self.MOVE_WEIGHTS):
+            raise ValueError(f"Unknown move types: {sorted(set(move_weights) - set(self.MOVE_WEIGHTS))}")
+        # Moves are applied in place: the solver owns `state` from here on.
+        self.current_solution = list(solution)
         self.current_state = state
+        self.positions = {a.session.index: i for i, a in enumerate(self.current_solution)}
         self.evaluator = evaluator
         self.model_data = model_data
         self.iterations = iterations
-        self.temp = initial_temp
+        self.temp = self.initial_temp = initial_temp
         self.cooling_rate = cooling_rate
-        self.current_cost = evaluator.calculate_total_cost(solution, state)
-        self.best_solution = copy.deepcopy(solution)
+        self.target_acceptance = target_acceptance
+        self.adaptive, self.reheat_after, self.patience, self.time_limit = adaptive, reheat_after, patience, time_limit
+        self.reheats = 0
+        self.steps = 0
+        self.stop_reason = None
+        self._step_rate = cooling_rate
+        self._window = [0, 0]  # uphill moves proposed / accepted in the current adaptation window
+        self._stale = self._since_reheat = 0
+        self._best_temp = initial_temp
+        self._started = None
+        self.incremental = IncrementalCostEvaluator(evaluator, self.current_solution)
+        self.current_cost = self.incremental.total_cost
+        # Best-so-far is kept as a flat list of ints, four per position
+        # (session, sequence, room, instructor index); a snapshot is a list copy
+        # and the Assignments are only rebuilt once, when optimize() returns.
+        self.sessions = {a.session.index: a.session for a in self.current_solution}
+        self.rooms = list(model_data['rooms'].values())
+        self.instructors = list(model_data['instructors'].values())
+        self.codes = [0] * (4 * len(self.current_solution))
+        self._record(self.current_solution)
+        self.best_codes = self.codes[:]
+        self.best_solution = self.current_solution[:]
         self.best_cost = self.current_cost
         self.progress_callback = progress_callback
+        self.batch_size, self.batch_policy = batch_size, batch_policy
+        self.batch = None
+        if batch_size:
+            try:
+                self.batch = BatchMoveEvaluator(evaluator, self.current_solution, state, seed=random.getrandbits(32))
+            except ValueError as e:
+                print(f"Batch moves disabled, using single moves: {e}")
+
+        self.move_kinds = [kind for kind, weight in move_weights.items() if weight > 0]
+        self.move_weights = [move_weights[kind] for kind in self.move_kinds]
+        self.move_stats = {kind: {'drawn': 0, 'applied': 0, 'accepted': 0} for kind in self.move_kinds}
+        self._generators = {'swap': self.generate_swap_neighbor, 'move': self.generate_move_neighbor,
+                            'room': self.generate_room_neighbor, 'instructor': self.generate_instructor_neighbor,
+                            'kempe': self.generate_kempe_neighbor, 'day_swap': self.generate_day_swap_neighbor}
+        # Swap partners share a compiled Domain, so each can take the other's value.
+        self.by_domain, self.section_sessions, self.by_sequence = {}, {}, {}
+        for a in self.current_solution:
+            self.by_domain.setdefault(id(a.session.domain), []).append(a.session.index)
+            for sec in a.session.sections: self.section_sessions.setdefault(sec.index, []).append(a.session.index)
+        Move.reindex(self.by_sequence, (), self.current_solution)
+        self.section_keys = list(self.section_sessions)
+        self._sequences = {}
+        self.sampler = PenaltySampler(self.incremental, self.current_solution) if guided and self.current_solution else None
 
     def optimize(self):
         print(f"Start Cost: {self.current_cost}")
-        
-        for i in range(self.iterations):
-            self.temp *= self.cooling_rate
-            
-            if random.random() < 0.5:
-                neighbor_solution, neighbor_state = self.generate_swap_neighbor()
-            else:
-                neighbor_solution, neighbor_state = self.generate_move_neighbor()
+        self._started = time.time()
+        if self.target_acceptance is not None:
+            self.calibrate_temperature(self.target_acceptance)
+        self.anneal(self.iterations)
+        # Early stopping is the normal outcome, so close the progress bar here.
+        if self.progress_callback:
+            self.progress_callback(self.iterations, self.iterations, self.best_cost)
+        self.best_solution = self._decode(self.best_codes)
+        print("Moves accepted/applied/drawn: " + ", ".join(
+            f"{kind} {st['accepted']}/{st['applied']}/{st['drawn']}" for kind, st in self.move_stats.items()))
+        if self.stop_reason:
+            print(f"Stopped after {self.steps} steps ({self.stop_reason}), {self.reheats} reheats")
+        return self.best_solution
 
-            if neighbor_solution is None:
+    def calibrate_temperature(self, target_acceptance, samples=None):
+        """
+        Sets the temperature at which the mean uphill delta of `samples`
+        trial moves (undone again) is accepted with probability
+        `target_acceptance`, and makes it the starting temperature.
+        """
+        if not 0 < target_acceptance < 1:
+            raise ValueError("target_acceptance must be between 0 and 1 (exclusive).")
+        uphill = []
+        for _ in range(samples or self.CALIBRATION_SAMPLES):
+            _, move = self.generate_neighbor()
+            if move is None:
                 continue
+            delta = self.incremental.delta(move.old, move.new)
+            move.undo(self.current_solution, self.current_state, self.positions, self.by_sequence)
+            if delta > 0: uphill.append(delta)
+        for st in self.move_stats.values():
+            st['drawn'] = st['applied'] = 0
+        if uphill:
+            self.temp = self.initial_temp = self._best_temp = -(sum(uphill) / len(uphill)) / math.log(target_acceptance)
+        return self.temp
 
-            new_cost = self.evaluator.calculate_total_cost(neighbor_solution, neighbor_state)
-            delta = new_cost - self.current_cost
+    def anneal(self, iterations):
+        """
+        Runs up to `iterations` steps on the current solution, updating the
+        best-so-far snapshot. Returns False if the run stopped early.
+        """
+        if self._started is None: self._started = time.time()
+        for i in range(iterations):
+            if self._should_stop():
+                return False
+            self.steps += 1
+            self.temp *= self._step_rate
+            
+            kind, move = self.generate_neighbor()
+            if move is None:
+                continue
+
+            delta = self.incremental.delta(move.old, move.new)
+            new_cost = self.current_cost + delta
 
             acceptance_prob = 1.0
             if delta > 0:
                 acceptance_prob = math.exp(-delta / self.temp)
             
-            if random.random() < acceptance_prob:
-                self.current_solution = neighbor_solution
-                self.current_state = neighbor_state
-                self.current_cost = new_cost
+            accepted = random.random() < acceptance_prob
+            if accepted:
+                self.current_cost = self.incremental.commit()
+                self._record(move.new)
+                self.move_stats[kind]['accepted'] += 1
+                if self.batch is not None: self.batch.apply(move.old, move.new)
+                if self.sampler is not None: self.sampler.refresh(move.old, move.new)
                 
                 if new_cost < self.best_cost:
                     self.best_cost = new_cost
-                    self.best_solution = copy.deepcopy(neighbor_solution)
+                    self.best_codes = self.codes[:]
+                    self._stale = self._since_reheat = 0
+                    self._best_temp = self.temp
+            else:
+                move.undo(self.current_solution, self.current_state, self.positions, self.by_sequence)
+            if self.adaptive and delta > 0: self._adapt(accepted)
             
             # Progress Callback
             if self.progress_callback and i % 100 == 0:
                 self.progress_callback(i, self.iterations, self.best_cost)
+        return True
 
-        return self.best_solution
+    def _should_stop(self):
+        """Counts a step without improvement, reheats when due and says whether to stop."""
+        self._stale += 1
+        self._since_reheat += 1
+        if self.patience is not None and self._stale > self.patience:
+            self.stop_reason = f"no improvement in {self.patience} steps"
+            return True
+        if self.time_limit is not None and self.steps % 100 == 0 and time.time() - self._started >= self.time_limit:
+            self.stop_reason = f"time limit of {self.time_limit}s"
+            return True
+        if self.reheat_after is not None and self._since_reheat > self.reheat_after:
+            self.temp = max(self.temp, min(self.initial_temp, self._best_temp * self.REHEAT_FACTOR))
+            self.reheats += 1
+            self._since_reheat = 0
+        return False
 
-    def generate_swap_neighbor(self):
-        if len(self.current_solution) < 2: return None, None
-        a1, a2 = random.sample(self.current_solution, 2)
-        if a1.session.duration_slots != a2.session.duration_slots: return None, None
-            
-        neighbor_state = copy.deepcopy(self.current_state)
-        neighbor_solution = list(self.current_solution)
-        
-        neighbor_state.remove_assignment(a1)
-        neighbor_state.remove_assignment(a2)
-        
-        new_a1 = Assignment(a1.session, a2.timeslot_sequence, a2.room, a2.instructor)
-        new_a2 = Assignment(a2.session, a1.timeslot_sequence, a1.room, a1.instructor)
+    def _adapt(self, accepted):
+        """Adjusts the per-step cooling rate to the acceptance ratio of the last window of uphill moves."""
+        self._window[0] += 1
+        self._window[1] += accepted
+        if self._window[0] < self.ADAPT_WINDOW:
+            return
+        ratio = self._window[1] / self._window[0]
+        if ratio > self.ADAPT_HIGH: self._step_rate = self.cooling_rate ** 2
+        elif ratio < self.ADAPT_LOW: self._step_rate = 1.0
+        else: self._step_rate = self.cooling_rate
+        self._window = [0, 0]
 
-        if any(slot in new_a1.instructor.not_preferred_slots for slot in new_a1.timeslot_sequence): return None, None
-        valid_a1 = (new_a1.instructor in a1.session.domain.instructors and
-                    new_a1.room in a1.session.domain.rooms and
-                    new_a1.timeslot_sequence in a1.session.domain.timeslot_sequences and
-                    neighbor_state.is_consistent(new_a1.session, new_a1.timeslot_sequence, new_a1.room, new_a1.instructor))
-        if not valid_a1: return None, None
+    def _record(self, assignments):
+        """Writes the compact encoding of `assignments` into self.codes."""
+        codes, positions = self.codes, self.positions
+        for a in assignments:
+            base = 4 * positions[a.session.index]
+            codes[base] = a.session.index
+            codes[base + 1] = a.session.domain.sequence_index[tuple(a.timeslot_sequence)]
+            codes[base + 2] = a.room.index
+            codes[base + 3] = a.instructor.index
 
-        neighbor_state.add_assignment(new_a1)
+    def _decode(self, codes):
+        """Rebuilds the Assignment list for a snapshot taken from self.codes."""
+        solution = []
+        for base in range(0, len(codes), 4):
+            session = self.sessions[codes[base]]
+            solution.append(Assignment(session, session.domain.timeslot_sequences[codes[base + 1]],
+                                       self.rooms[codes[base + 2]], self.instructors[codes[base + 3]]))
+        return solution
 
-        if any(slot in new_a2.instructor.not_preferred_slots for slot in new_a2.timeslot_sequence): return None, None
-        valid_a2 = (new_a2.instructor in a2.session.domain.instructors and
-                    new_a2.room in a2.session.domain.rooms and
-                    new_a2.timeslot_sequence in a2.session.domain.timeslot_sequences and
-                    neighbor_state.is_consistent(new_a2.session, new_a2.timeslot_sequence, new_a2.room, new_a2.instructor))
-        if not valid_a2: return None, None
+    def generate_neighbor(self):
+        """Draws a move type by weight and tries it. Returns (type, the applied Move or None)."""
+        kind = random.choices(self.move_kinds, self.move_weights)[0]
+        self.move_stats[kind]['drawn'] += 1
+        if kind == 'move' and self.batch is not None:
+            move = self.generate_batch_neighbor()
+        else:
+            move = self._generators[kind]()
+        if move is not None: self.move_stats[kind]['applied'] += 1
+        return kind, move
 
-        neighbor_state.add_assignment(new_a2)
-        
-        neighbor_solution.remove(a1)
-        neighbor_solution.remove(a2)
-        neighbor_solution.append(new_a1)
-        neighbor_solution.append(new_a2)
-        
-        return neighbor_solution, neighbor_state
+    def _pick(self):
+        """A solution position: penalty-weighted when guided, otherwise uniform."""
+        if self.sampler is not None: return self.sampler.sample()
+        return random.randrange(len(self.current_solution))
+
+    def _sequences_for(self, domain, instructor):
+        """Cached Domain.sequences_for."""
+        key = (id(domain), instructor.index)
+        seqs = self._sequences.get(key)
+        if seqs is None:
+            seqs = self._sequences[key] = domain.sequences_for(instructor)
+        return seqs
+
+    def _try(self, old, new):
+        move = Move(old, new)
+        return move if move.try_apply(self.current_solution, self.current_state, self.positions, self.by_sequence) else None
+
+    def generate_swap_neighbor(self):
+        """
+        Swaps time, room and instructor of two sessions with the same Domain,
+        skipping interchangeable ones (equal symmetry_key), whose swap changes
+        nothing. Returns the applied Move or None.
+        """
+        if len(self.current_solution) < 2: return None
+        a1 = self.current_solution[self._pick()]
+        partners = self.by_domain[id(a1.session.domain)]
+        if len(partners) < 2: return None
+        key = a1.session.symmetry_key
+        for _ in range(self.MOVE_SAMPLES):
+            a2 = self.current_solution[self.positions[random.choice(partners)]]
+            if a2 is not a1 and (key is None or a2.session.symmetry_key != key): break
+        else:
+            return None
+
+        new_a1 = Assignment(a1.session, a2.timeslot_sequence, a2.room, a2.instructor)
+        new_a2 = Assignment(a2.session, a1.timeslot_sequence, a1.room, a1.instructor)
+        return self._try([a1, a2], [new_a1, new_a2])
+
+    def generate_batch_neighbor(self):
+        """Picks one of `batch_size` relocations scored together by self.batch. Returns the applied Move or None."""
+        picks = None
+        if self.sampler is not None:
+            picks = [self.current_solution[self._pick()].session.index for _ in range(self.batch_size)]
+        sessions, seqs, rooms, valid, delta = self.batch.propose(self.batch_size, picks)
+        candidates = np.flatnonzero(valid)
+        if not len(candidates): return None
+        c = candidates[np.argmin(delta[candidates])]
+        if self.batch_policy == 'metropolis':
+            weights = np.exp(-np.maximum(delta[candidates], 0) / self.temp)
+            if weights.sum() > 0:
+                c = candidates[self.batch.rng.choice(len(candidates), p=weights / weights.sum())]
+        old = self.current_solution[self.positions[int(sessions[c])]]
+        new = Assignment(old.session, self.batch.sequences[seqs[c]], self.rooms[rooms[c]], old.instructor)
+        return self._try([old], [new])
 
     def generate_move_neighbor(self):
-        if not self.current_solution: return None, None
+        """Moves one session to a random free time and room. Returns the applied Move or None."""
+        if not self.current_solution: return None
         
-        target_idx = random.randint(0, len(self.current_solution) - 1)
+        target_idx = self._pick()
         target_assignment = self.current_solution[target_idx]
         var = target_assignment.session
-        
-        neighbor_state = copy.deepcopy(self.current_state)
-        neighbor_solution = list(self.current_solution)
-        neighbor_state.remove_assignment(target_assignment)
-        
-        candidates = []
         inst = target_assignment.instructor
+        seqs, rooms = self._sequences_for(var.domain, inst), var.domain.rooms
+        if not seqs or not rooms: return None
         
-        for t_seq in var.domain.timeslot_sequences:
-            if any(slot in inst.not_preferred_slots for slot in t_seq):
-                continue
-            for room in var.domain.rooms:
-                candidates.append((t_seq, room))
-        
-        random.shuffle(candidates)
-        
-        for (rand_time, rand_room) in candidates:
-             if neighbor_state.is_consistent(var, rand_time, rand_room, inst):
+        state = self.current_state
+        state.remove_assignment(target_assignment)
+        for _ in range(self.MOVE_SAMPLES):
+            rand_time, rand_room = random.choice(seqs), random.choice(rooms)
+            if state.is_consistent(var, rand_time, rand_room, inst):
                 new_assignment = Assignment(var, rand_time, rand_room, inst)
-                neighbor_state.add_assignment(new_assignment)
-                neighbor_solution[target_idx] = new_assignment
-                return neighbor_solution, neighbor_state
-                
-        return None, None
+                state.add_assignment(new_assignment)
+                self.current_solution[target_idx] = new_assignment
+                Move.reindex(self.by_sequence, [target_assignment], [new_assignment])
+                return Move([target_assignment], [new_assignment])
+        state.add_assignment(target_assignment)
+        return None
+
+    def generate_room_neighbor(self):
+        """Moves one session to another free room at the same time. Returns the applied Move or None."""
+        if not self.current_solution: return None
+        old = self.current_solution[self._pick()]
+        rooms, state = old.session.domain.rooms, self.current_state
+        mask = state.sequence_mask(old.timeslot_sequence)
+        for _ in range(min(self.MOVE_SAMPLES, len(rooms))):
+            room = random.choice(rooms)
+            if room is not old.room and not state.room_masks[room.index] & mask:
+                return self._try([old], [Assignment(old.session, old.timeslot_sequence, room, old.instructor)])
+        return None
+
+    def generate_instructor_neighbor(self):
+        """Hands one session to another candidate instructor free and allowed at that time. Returns the applied Move or None."""
+        if not self.current_solution: return None
+        old = self.current_solution[self._pick()]
+        domain, state = old.session.domain, self.current_state
+        seq = tuple(old.timeslot_sequence)
+        mask = state.sequence_mask(seq)
+        for _ in range(min(self.MOVE_SAMPLES, len(domain.instructors))):
+            inst = random.choice(domain.instructors)
+            if (inst is not old.instructor and not state.instructor_masks[inst.index] & mask
+                    and seq in domain.allowed_sequences[inst.instructor_id]):
+                return self._try([old], [Assignment(old.session, seq, old.room, inst)])
+        return None
+
+    def generate_kempe_neighbor(self):
+        """
+        Kempe chain: one session moves to another timeslot sequence of the
+        same length; every session on either sequence that shares a section,
+        instructor or room with a moved session moves to the other one, and
+        so on. Chains longer than KEMPE_LIMIT are dropped. Returns the applied
+        Move or None.
+        """
+        if not self.current_solution: return None
+        start = self.current_solution[self._pick()]
+        seq_a = tuple(start.timeslot_sequence)
+        seq_b = random.choice(self._sequences_for(start.session.domain, start.instructor))
+        if seq_b == seq_a: return None
+        other = {seq_a: seq_b, seq_b: seq_a}
+        on = {seq: self.by_sequence.get(seq, {}).values() for seq in other}
+
+        chain, frontier, members = [start], [start], {start.session.index}
+        while frontier:
+            a = frontier.pop()
+            for b in on[other[tuple(a.timeslot_sequence)]]:
+                if b.session.index in members or not self._clash(a, b): continue
+                if len(chain) == self.KEMPE_LIMIT: return None
+                members.add(b.session.index)
+                chain.append(b)
+                frontier.append(b)
+
+        new = []
+        for a in chain:
+            seq = other[tuple(a.timeslot_sequence)]
+            if not a.session.domain.has_value(seq, a.room, a.instructor): return None
+            new.append(Assignment(a.session, seq, a.room, a.instructor))
+        return self._try(chain, new)
+
+    def _clash(self, a, b):
+        return (a.instructor is b.instructor or a.room is b.room or
+                any(sec in b.session.sections for sec in a.session.sections))
+
+    def generate_day_swap_neighbor(self):
+        """
+        Swaps one section's sessions between two days, each keeping its
+        position within the day (sessions shared with other sections take
+        them along). Returns the applied Move or None.
+        """
+        day_slots, slot_pattern = self.evaluator.day_slots, self.evaluator.slot_pattern
+        if not self.section_keys or len(day_slots) < 2: return None
+        if self.sampler is not None:
+            section = random.choice(self.current_solution[self._pick()].session.sections).index
+        else:
+            section = random.choice(self.section_keys)
+        sessions = self.section_sessions[section]
+        d1, d2 = random.sample(range(len(day_slots)), 2)
+        old, new = [], []
+        for s in sessions:
+            a = self.current_solution[self.positions[s]]
+            day = slot_pattern[a.timeslot_sequence[0]][0]
+            if day not in (d1, d2): continue
+            target = day_slots[d2 if day == d1 else d1]
+            seq = []
+            for slot_id in a.timeslot_sequence:
+                i = slot_pattern[slot_id][1].bit_length() - 1
+                if i >= len(target): return None
+                seq.append(target[i])
+            seq = tuple(seq)
+            if not a.session.domain.has_value(seq, a.room, a.instructor): return None
+            old.append(a)
+            new.append(Assignment(a.session, seq, a.room, a.instructor))
+        if not old: return None
+        return self._try(old, new)
+
+class TabuSearchSolver(SimulatedAnnealingSolver):
+    """
+    Phase 2 alternative with the SimulatedAnnealingSolver interface. Each step
+    samples `sample_size` neighbours (see SimulatedAnnealingSolver for the move
+    types), scores them with the incremental evaluator and takes the best one
+    that is not tabu, even if it is worse.
+    Moving a session off a timeslot sequence makes (session, sequence) tabu for
+    `tenure` steps; moves that keep a session's sequence (room, instructor,
+    same-slot swaps) are never tabu. A tabu move is still allowed when it
+    beats the best cost found so far (aspiration). `patience` and `time_limit`
+    stop the run early as in SimulatedAnnealingSolver.
+    """
+    def __init__(self, solution, state, evaluator, model_data, iterations=1000, sample_size=50, tenure=15, progress_callback=None,
+                 patience=None, time_limit=None):
+        super().__init__(solution, state, evaluator, model_data, iterations=iterations, progress_callback=progress_callback,
+                         patience=patience, time_limit=time_limit)
+        self.sample_size = sample_size
+        self.tenure = tenure
+        self.tabu_until = {}
+        self.aspirations = 0
+
+    def anneal(self, iterations):
+        """
+        Runs up to `iterations` tabu steps (kept under the SA name so callers can
+        drive either engine). Returns False if the run stopped early.
+        """
+        if self._started is None: self._started = time.time()
+        for i in range(iterations):
+            if self._should_stop():
+                return False
+            self.steps += 1
+            self.step(i)
+            if self.progress_callback and i % 100 == 0:
+                self.progress_callback(i, self.iterations, self.best_cost)
+        return True
+
+    def step(self, i):
+        """Applies the best admissible neighbour of a sampled batch. Returns False if there was none."""
+        best_move, best_delta, best_kind, best_tabu = None, None, None, False
+        for _ in range(self.sample_size):
+            kind, move = self.generate_neighbor()
+            if move is None:
+                continue
+            move.undo(self.current_solution, self.current_state, self.positions, self.by_sequence)
+            delta = self.incremental.delta(move.old, move.new)
+            if best_delta is not None and delta >= best_delta:
+                continue
+            tabu = self._is_tabu(move, i)
+            if tabu and self.current_cost + delta >= self.best_cost:
+                continue
+            best_move, best_delta, best_kind, best_tabu = move, delta, kind, tabu
+
+        if best_move is None or not best_move.try_apply(self.current_solution, self.current_state, self.positions, self.by_sequence):
+            return False
+        self.incremental.delta(best_move.old, best_move.new)
+        self.current_cost = self.incremental.commit()
+        self._record(best_move.new)
+        self.move_stats[best_kind]['accepted'] += 1
+        if self.sampler is not None: self.sampler.refresh(best_move.old, best_move.new)
+        if best_tabu: self.aspirations += 1
+        for a, _ in self._relocations(best_move):
+            self.tabu_until[(a.session.index, tuple(a.timeslot_sequence))] = i + self.tenure
+        if self.current_cost < self.best_cost:
+            self.best_cost = self.current_cost
+            self.best_codes = self.codes[:]
+            self._stale = 0
+        return True
+
+    def _is_tabu(self, move, i):
+        return any(self.tabu_until.get((a.session.index, seq), -1) > i for a, seq in self._relocations(move))
+
+    @staticmethod
+    def _relocations(move):
+        """(old assignment, new sequence) for the sessions the move puts on another timeslot sequence."""
+        new_sequences = {a.session.index: tuple(a.timeslot_sequence) for a in move.new}
+        return [(a, new_sequences[a.session.index]) for a in move.old
+                if new_sequences.get(a.session.index, tuple(a.timeslot_sequence)) != tuple(a.timeslot_sequence)]
+
+def _tempering_worker(conn, model_data, solution, weights):
+    """
+    Process loop of a ParallelTemperingSolver worker. The replicas it owns are
+    built once from the Phase 1 solution and stay alive between rounds; each
+    round message lists (replica, temperature, steps, seed) and the reply
+    carries every replica's current cost and, when it improved, its best
+    snapshot. None ends the loop.
+    """
+    try:
+        evaluator = CostEvaluator(model_data, weights=weights)
+        replicas = {}
+        while True:
+            tasks = conn.recv()
+            if tasks is None:
+                break
+            results = []
+            for r, temp, steps, seed in tasks:
+                random.seed(seed)
+                replica = replicas.get(r)
+                if replica is None:
+                    state = TimetableState(model_data)
+                    for a in solution: state.add_assignment(a)
+                    replica = replicas[r] = SimulatedAnnealingSolver(solution, state, evaluator, model_data,
+                                                                     iterations=0, cooling_rate=1.0)
+                replica.temp = temp
+                best_before = replica.best_cost
+                replica.anneal(steps)
+                improved = replica.best_cost < best_before
+                results.append((r, replica.current_cost, replica.best_cost, replica.best_codes if improved else None))
+            conn.send(results)
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+class ParallelTemperingSolver:
+    """
+    Phase 2 alternative to SimulatedAnnealingSolver: `replicas` chains at fixed
+    temperatures on a geometric ladder between min_temp and max_temp, spread
+    over `workers` processes that keep their replicas alive for the whole run.
+    Every `exchange_interval` iterations neighbouring temperatures may trade
+    replicas (Metropolis test on the cost difference), so rounds only ship
+    temperatures, seeds and costs. Replica seeds and exchange decisions all
+    come from one rng, so a given seed reproduces the run.
+    `iterations` is per replica; after `time_limit` seconds no new round starts.
+    """
+    def __init__(self, solution, state, evaluator, model_data, iterations=50000, replicas=None, workers=None,
+                 min_temp=0.5, max_temp=20.0, exchange_interval=250, seed=0, progress_callback=None, time_limit=None):
+        if min_temp <= 0 or max_temp < min_temp:
+            raise ValueError("Temperatures must satisfy 0 < min_temp <= max_temp.")
+        self.base = SimulatedAnnealingSolver(solution, state, evaluator, model_data, iterations=0)
+        self.evaluator = evaluator
+        self.model_data = model_data
+        self.iterations = iterations
+        self.workers = workers or os.cpu_count() or 1
+        self.replicas = replicas or self.workers
+        self.workers = min(self.workers, self.replicas)
+        ratio = (max_temp / min_temp) ** (1.0 / max(self.replicas - 1, 1))
+        self.temperatures = [min_temp * ratio ** r for r in range(self.replicas)]
+        self.exchange_interval = exchange_interval
+        self.rng = random.Random(seed)
+        self.progress_callback = progress_callback
+        self.time_limit = time_limit
+        self.best_cost = self.base.best_cost
+        self.best_solution = self.base.best_solution
+        self.exchanges = 0
+        self.exchange_attempts = 0
+
+    def optimize(self):
+        print(f"Start Cost: {self.best_cost} ({self.replicas} replicas, {self.workers} workers)")
+        started = time.time()
+        at = list(range(self.replicas))  # temperature rung -> replica
+        costs = [self.base.current_cost] * self.replicas
+        best_codes = self.base.best_codes
+
+        context = multiprocessing.get_context()
+        pipes, processes = [], []
+        for _ in range(self.workers):
+            conn, child = context.Pipe()
+            process = context.Process(target=_tempering_worker, daemon=True,
+                                      args=(child, self.model_data, self.base.current_solution, self.evaluator.weights))
+            process.start()
+            child.close()
+            pipes.append(conn)
+            processes.append(process)
+        try:
+            done, rounds = 0, 0
+            while done < self.iterations:
+                if self.time_limit is not None and time.time() - started >= self.time_limit:
+                    break
+                steps = min(self.exchange_interval, self.iterations - done)
+                tasks = [[] for _ in pipes]
+                for rung, r in enumerate(at):
+                    tasks[r % self.workers].append((r, self.temperatures[rung], steps, self.rng.getrandbits(32)))
+                for conn, worker_tasks in zip(pipes, tasks):
+                    conn.send(worker_tasks)
+                for conn in pipes:
+                    results = conn.recv()
+                    if isinstance(results, Exception):
+                        raise results
+                    for r, cost, replica_best_cost, replica_best in results:
+                        costs[r] = cost
+                        if replica_best is not None and replica_best_cost < self.best_cost:
+                            self.best_cost, best_codes = replica_best_cost, replica_best
+                done += steps
+                self._exchange(at, costs, rounds % 2)
+                rounds += 1
+
+                if self.progress_callback:
+                    self.progress_callback(done, self.iterations, self.best_cost)
+            if self.progress_callback and done < self.iterations:
+                self.progress_callback(self.iterations, self.iterations, self.best_cost)
+        finally:
+            for conn in pipes:
+                try: conn.send(None)
+                except (BrokenPipeError, OSError): pass
+                conn.close()
+            for process in processes:
+                process.join()
+
+        self.best_solution = self.base._decode(best_codes)
+        return self.best_solution
+
+    def _exchange(self, at, costs, offset):
+        """Offers a replica swap to every other neighbouring pair of temperatures."""
+        temps = self.temperatures
+        for k in range(offset, self.replicas - 1, 2):
+            self.exchange_attempts += 1
+            log_accept = (costs[at[k]] - costs[at[k + 1]]) * (1.0 / temps[k] - 1.0 / temps[k + 1])
+            if log_accept >= 0 or self.rng.random() < math.exp(log_accept):
+                at[k], at[k + 1] = at[k + 1], at[k]
+                self.exchanges += 1
+
+class LargeNeighborhoodSearch:
+    """
+    Phase 2 engine: destroys a section-day, instructor-week or room-day cluster
+    and keeps the cheapest BacktrackingSolver repair if it lowers the cost.
+    """
+    NEIGHBORHOODS = ('section_day', 'instructor_week', 'room_day')
+
+    def __init__(self, solution, state, evaluator, model_data, iterations=1000, max_destroy=12, repair_samples=4,
+                 repair_node_limit=2000, time_limit=None, seed=0, progress_callback=None, guided=False):
+        # Repairs are applied in place: the solver owns `state` from here on.
+        self.current_solution = list(solution)
+        self.current_state = state
+        self.positions = {a.session.index: i for i, a in enumerate(self.current_solution)}
+        self.evaluator = evaluator
+        self.model_data = model_data
+        self.iterations = iterations
+        self.max_destroy = max_destroy
+        self.repair_samples = repair_samples
+        self.repair_node_limit = repair_node_limit
+        self.time_limit = time_limit
+        self.rng = random.Random(seed)
+        self.progress_callback = progress_callback
+        self.incremental = IncrementalCostEvaluator(evaluator, self.current_solution)
+        self.current_cost = self.incremental.total_cost
+        self.best_cost = self.current_cost
+        self.best_solution = self.current_solution
+        self.improvements = 0
+        self.failed_repairs = 0
+        self.sampler = PenaltySampler(self.incremental, self.current_solution, rng=self.rng) if guided and self.current_solution else None
+
+    def optimize(self):
+        print(f"Start Cost: {self.current_cost}")
+        started = time.time()
+        for i in range(self.iterations):
+            if self.time_limit is not None and time.time() - started >= self.time_limit:
+                break
+            cluster = self.select_cluster(self.rng.choice(self.NEIGHBORHOODS))
+            if cluster:
+                self.destroy_and_repair(cluster)
+
+            if self.progress_callback and i % 10 == 0:
+                self.progress_callback(i, self.iterations, self.best_cost)
+
+        if self.progress_callback:
+            self.progress_callback(self.iterations, self.iterations, self.best_cost)
+        self.best_solution = list(self.current_solution)
+        return self.best_solution
 
-def run_web_solver(data_frames, weights, progress_callback=None):
+    def select_cluster(self, kind):
+        """Assignments sharing a section-day, instructor or room-day with a random session."""
+        if self.sampler is not None:
+            anchor = self.current_solution[self.sampler.sample()]
+        else:
+            anchor = self.rng.choice(self.current_solution)
+        slot_day = self.evaluator.slot_day
+        day = slot_day[anchor.timeslot_sequence[0]]
+        if kind == 'section_day':
+            section = self.rng.choice(anchor.session.sections)
+            cluster = [a for a in self.current_solution
+                       if section in a.session.sections and slot_day[a.timeslot_sequence[0]] == day]
+        elif kind == 'instructor_week':
+            cluster = list(self.incremental.inst_assignments[anchor.instructor.index].values())
+        elif kind == 'room_day':
+            cluster = [a for a in self.current_solution
+                       if a.room is anchor.room and slot_day[a.timeslot_sequence[0]] == day]
+        else:
+            raise ValueError(f"Unknown neighborhood: {kind}")
+        if len(cluster) > self.max_destroy:
+            cluster = self.rng.sample(cluster, self.max_destroy)
+        return cluster
+
+    def destroy_and_repair(self, cluster):
+        """Re-solves `cluster` against the rest of the timetable. Returns True if the cost dropped."""
+        state = self.current_state
+        for a in cluster: state.remove_assignment(a)
+
+        best_repair, best_delta = None, 0
+        for _ in range(self.repair_samples):
+            solver = BacktrackingSolver([a.session for a in cluster], self.model_data, variable_ordering='mrv',
+                                        node_limit=self.repair_node_limit, seed=self.rng.getrandbits(32), initial_state=state,
+                                        sequence_cost=self._placement_cost)
+            repair, _ = solver.solve()
+            if not repair:
+                self.failed_repairs += 1
+                continue
+            delta = self.incremental.delta(cluster, repair)
+            if delta < best_delta:
+                best_repair, best_delta = list(repair), delta
+
+        if best_repair is None:
+            for a in cluster: state.add_assignment(a)
+            return False
+
+        self.incremental.delta(cluster, best_repair)
+        self.current_cost = self.best_cost = self.incremental.commit()
+        for a in best_repair:
+            state.add_assignment(a)
+            self.current_solution[self.positions[a.session.index]] = a
+        if self.sampler is not None: self.sampler.refresh(cluster, best_repair)
+        self.improvements += 1
+        return True
+
+    def _placement_cost(self, var, seq, state):
+        """Time-of-day and section gap/load penalty of putting `var` at `seq` in the repair state."""
+        ev = self.evaluator
+        cost = ev._time_cost(seq)
+        for section in var.sections:
+            slots = state.section_slots(section.section_id)
+            cost += ev._section_cost(slots | set(seq)) - ev._section_cost(slots)
+        return cost
+
+def run_web_solver(data_frames, weights, progress_callback=None, iterations=None, propagation=None, variable_ordering='static',
+                   restart_policy='luby', phase1_time_limit=120.0, seed=0, phase2_mode='anneal', phase2_workers=None,
+                   phase1_fallback=True, phase1_mode='backtracking', phase1_workers=None, phase2_batch_size=None,
+                   phase2_time_limit=120.0):
     """
     Main entry point for the web app.
+    phase1_mode: 'backtracking' (BacktrackingSolver with the options above),
+    'portfolio' (PortfolioSolver racing its default strategies on
+    `phase1_workers` processes), 'decomposed' (DecomposedSolver running
+    BacktrackingSolver with the options above on independent parts of the
+    problem in `phase1_workers` processes) or 'two_stage' (TwoStageSolver:
+    time and instructors first, rooms by matching afterwards).
+    If backtracking runs out of time without a timetable and phase1_fallback
+    is set, Phase 1 is retried with MinConflictsSolver under the same time
+    limit. If it proves there is none, MinConflictsSolver only runs for
+    DIAGNOSTIC_TIME_LIMIT seconds to report the clashes.
+    phase2_mode: 'anneal' (single simulated annealing chain), 'tempering'
+    (ParallelTemperingSolver on `phase2_workers` processes, default all cores),
+    'lns' (LargeNeighborhoodSearch, iterations // 20 repairs) or 'tabu'
+    (TabuSearchSolver, iterations // 50 steps of 50 sampled neighbours).
+    phase2_batch_size: in 'anneal' mode, score this many relocation moves per
+    step with NumPy and propose the best one (SimulatedAnnealingSolver
+    batch_size).
+    iterations: Phase 2 step budget, by default max(10000, 500 * sessions) in
+    'anneal' mode (which also stops after 60 * sessions steps without a new
+    best) and 10000 otherwise. Every mode also stops after phase2_time_limit
+    seconds.
     """
+    if phase1_mode not in ('backtracking', 'portfolio', 'decomposed', 'two_stage'):
+        raise ValueError(f"Unknown phase1_mode: {phase1_mode}")
+    if phase2_mode not in ('anneal', 'tempering', 'lns', 'tabu'):
+        raise ValueError(f"Unknown phase2_mode: {phase2_mode}")
     print("--- Starting Web Solver ---")
     
     # 1. Ingest Data
@@ -591,25 +3268,104 @@ def run_web_solver(data_frames, weights, progress_callback=None):
     domain_builder.build_all_domains(all_variables)
     
     # 4. Phase 1: Backtracking
-    solver = BacktrackingSolver(all_variables, model_data)
+    if phase1_mode == 'portfolio':
+        solver = PortfolioSolver(all_variables, model_data, workers=phase1_workers, time_limit=phase1_time_limit)
+    elif phase1_mode == 'decomposed':
+        solver = DecomposedSolver(all_variables, model_data, workers=phase1_workers, time_limit=phase1_time_limit,
+                                  propagation=propagation, variable_ordering=variable_ordering,
+                                  restart_policy=restart_policy, seed=seed)
+    elif phase1_mode == 'two_stage':
+        solver = TwoStageSolver(all_variables, model_data, time_limit=phase1_time_limit, propagation=propagation,
+                                variable_ordering=variable_ordering, restart_policy=restart_policy, seed=seed)
+    else:
+        solver = BacktrackingSolver(all_variables, model_data, propagation=propagation, variable_ordering=variable_ordering,
+                                    restart_policy=restart_policy, time_limit=phase1_time_limit, seed=seed)
     phase1_solution, phase1_state = solver.solve()
     
+    # The default portfolio already races a min-conflicts strategy.
+    if not phase1_solution and phase1_mode != 'portfolio' and (phase1_fallback or not solver.budget_exhausted):
+        if solver.budget_exhausted:
+            print("Backtracking found no timetable in time; falling back to min-conflicts search.")
+            limit = phase1_time_limit
+        else:
+            print("Backtracking proved there is no valid timetable; collecting the conflicts.")
+            limit = MinConflictsSolver.DIAGNOSTIC_TIME_LIMIT
+            if phase1_time_limit is not None: limit = min(limit, phase1_time_limit)
+        fallback = MinConflictsSolver(all_variables, model_data, time_limit=limit, seed=seed)
+        phase1_solution, phase1_state = fallback.solve()
+        if not phase1_solution:
+            conflicts = fallback.conflict_report(limit=5)
+            raise ValueError(f"Phase 1 Solver failed to find a valid initial timetable; the best assignment found "
+                             f"still has {fallback.conflicts} hard conflicts, e.g.: " + "; ".join(conflicts))
+
     if not phase1_solution:
+        if solver.budget_exhausted:
+            raise ValueError(f"Phase 1 Solver found no valid initial timetable within {phase1_time_limit}s "
+                             f"({solver.nodes_visited} nodes, {solver.restarts} restarts).")
         raise ValueError("Phase 1 Solver failed to find a valid initial timetable.")
         
     # 5. Phase 2: Simulated Annealing
     evaluator = CostEvaluator(model_data, weights=weights)
-    optimizer = SimulatedAnnealingSolver(
-        phase1_solution, 
-        phase1_state, 
-        evaluator, 
-        model_data,
-        iterations=10000, # Reduced for web responsiveness, or make configurable
-        initial_temp=20.0,
-        progress_callback=progress_callback
-    )
+    n = len(phase1_solution)
+    if iterations is None:
+        iterations = max(10000, 500 * n) if phase2_mode == 'anneal' else 10000
+    if phase2_mode == 'tempering':
+        optimizer = ParallelTemperingSolver(
+            phase1_solution,
+            phase1_state,
+            evaluator,
+            model_data,
+            iterations=iterations,
+            workers=phase2_workers,
+            max_temp=20.0,
+            seed=seed,
+            progress_callback=progress_callback,
+            time_limit=phase2_time_limit
+        )
+    elif phase2_mode == 'lns':
+        optimizer = LargeNeighborhoodSearch(
+            phase1_solution,
+            phase1_state,
+            evaluator,
+            model_data,
+            iterations=max(1, iterations // 20),
+            time_limit=phase2_time_limit,
+            seed=seed,
+            progress_callback=progress_callback
+        )
+    elif phase2_mode == 'tabu':
+        optimizer = TabuSearchSolver(
+            phase1_solution,
+            phase1_state,
+            evaluator,
+            model_data,
+            iterations=max(1, iterations // 50),
+            sample_size=50,
+            progress_callback=progress_callback,
+            time_limit=phase2_time_limit
+        )
+    else:
+        optimizer = SimulatedAnnealingSolver(
+            phase1_solution, 
+            phase1_state, 
+            evaluator, 
+            model_data,
+            iterations=iterations,
+            progress_callback=progress_callback,
+            batch_size=phase2_batch_size,
+            target_acceptance=0.3,
+            adaptive=True,
+            reheat_after=15 * n,
+            patience=60 * n,
+            time_limit=phase2_time_limit
+        )
     
     final_solution = optimizer.optimize()
+    final_state = TimetableState(model_data)
+    for assignment in final_solution: final_state.add_assignment(assignment)
+    breakdown = evaluator.penalty_breakdown(final_solution, final_state)
+    worst = sorted(((cost, kind, name) for kind, costs in breakdown.items() for name, cost in costs.items()), reverse=True)[:5]
+    print("Largest remaining penalties: " + ", ".join(f"{kind[:-1]} {name}: {cost}" for cost, kind, name in worst))
     
     # 6. Convert to DataFrame
     output_data = []
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import solver_engine  # noqa: E402
+
+
+def load_sample_frames():
+    data = os.path.join(ROOT, "Data")
+    return {
+        'courses': pd.read_csv(os.path.join(data, "Courses.csv")),
+        'rooms': pd.read_csv(os.path.join(data, "Rooms.csv")),
+        'instructors': pd.read_csv(os.path.join(data, "Instructors.csv")),
+        'timeslots': pd.read_csv(os.path.join(data, "TimeSlots.csv")),
+        'sections': pd.read_excel(os.path.join(data, "sections_data.xlsx")),
+        'available_courses': pd.read_csv(os.path.join(data, "Avilable_Course.csv")),
+    }
+
+
+@pytest.fixture(scope="session")
+def sample_frames():
+    return load_sample_frames()
+
+
+def build_model(frames):
+    model_data = solver_engine.DataIngestor(frames).ingest_all()
+    variables = solver_engine.VariableGenerator(model_data, max_group_capacity=75).generate_all_variables()
+    solver_engine.DomainBuilder(model_data).build_all_domains(variables)
+    return model_data, variables
+
+
+@pytest.fixture
+def sample(sample_frames):
+    """(model_data, variables) for the sample data, with domains built."""
+    return build_model(sample_frames)
+
+
+@pytest.fixture
+def tight_sample(sample_frames):
+    """The sample data with only the first 17 timeslots: hard enough to need backtracking."""
+    return build_model(dict(sample_frames, timeslots=sample_frames['timeslots'].head(17)))
+
+
+@pytest.fixture
+def small_sample(sample_frames):
+    """
+    Builder for cut-down instances: build(courses, sections, slots, copies=1)
+    keeps the first courses[level] CSIT courses of each level (each listed
+    `copies` times), the first `sections` CSIT sections of those levels, the
+    first `slots` timeslots, their preferred instructors and two pairs of
+    identical rooms (75-seat lecture, 25-seat lab). Small enough for the
+    search to prove infeasibility.
+    """
+    f = sample_frames
+    offered, secs, rooms, instructors = f['available_courses'], f['sections'], f['rooms'], f['instructors']
+
+    def build(courses, sections, slots, copies=1):
+        rows = pd.concat([offered[(offered.Department == 'CSIT') & (offered.Level == level)].head(n)
+                          for level, n in courses.items()])
+        names = set(rows.preferred_Prof) | {a for assistants in rows.preferred_Assi for a in str(assistants).split(',')}
+        return build_model(dict(
+            f,
+            available_courses=pd.concat([rows] * copies, ignore_index=True),
+            sections=pd.concat([secs[(secs.Department == 'CSIT') & (secs.Level == level)].head(sections) for level in courses]),
+            timeslots=f['timeslots'].head(slots),
+            rooms=pd.concat([rooms[(rooms.Type == 'Lecture') & (rooms.Capacity == 75)].head(2),
+                             rooms[(rooms.Type == 'Lab') & (rooms.Capacity == 25)].head(2)]),
+            instructors=instructors[instructors.InstructorID.isin(names)],
+        ))
+    return build
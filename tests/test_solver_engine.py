@@ -0,0 +1,662 @@
+import itertools
+import random
+
+import pytest
+
+import solver_engine as se
+
+
+def assert_valid(solution, variables):
+    """Every session placed once, inside its domain, without a double booking."""
+    assert sorted(a.session.index for a in solution) == sorted(var.index for var in variables)
+    booked = set()
+    for a in solution:
+        assert a.session.domain.has_value(a.timeslot_sequence, a.room, a.instructor)
+        for slot in a.timeslot_sequence:
+            keys = [('room', a.room.room_id), ('instructor', a.instructor.instructor_id)]
+            keys += [('section', sec.section_id) for sec in a.session.sections]
+            for key in keys:
+                assert (key, slot) not in booked, f"{key} double-booked in slot {slot}"
+                booked.add((key, slot))
+
+
+def solve_phase1(sample):
+    model_data, variables = sample
+    solution, state = se.BacktrackingSolver(variables, model_data, time_limit=30).solve()
+    assert solution is not None
+    return solution, state
+
+
+def occupancy(state):
+    """Every occupancy list of a TimetableState, for comparing two states."""
+    return (list(state.instructor_masks), list(state.room_masks), list(state.section_masks),
+            list(state.slot_rooms), list(state.slot_instructors))
+
+
+# --- Cost evaluation ---
+
+def test_incremental_cost_matches_full_cost_for_every_move_type(sample):
+    model_data, variables = sample
+    random.seed(5)
+    solution, state = solve_phase1(sample)
+    evaluator = se.CostEvaluator(model_data)
+    solver = se.SimulatedAnnealingSolver(solution, state, evaluator, model_data, iterations=0)
+    assert solver.current_cost == evaluator.calculate_total_cost(solution, state)
+    for _ in range(400):
+        kind, move = solver.generate_neighbor()
+        if move is None: continue
+        delta = solver.incremental.delta(move.old, move.new)
+        assert solver.current_cost + delta == evaluator.calculate_total_cost(solver.current_solution, solver.current_state), kind
+        if random.random() < 0.5:
+            solver.current_cost = solver.incremental.commit()
+            solver.sampler.refresh(move.old, move.new)
+        else:
+            move.undo(solver.current_solution, solver.current_state, solver.positions, solver.by_sequence)
+        assert solver.incremental.verify(solver.current_solution, solver.current_state)
+    # Day swaps move a section's whole day and rarely fit the tight sample timetable.
+    assert {kind for kind, stats in solver.move_stats.items() if stats['applied']} >= {'swap', 'move', 'room', 'instructor', 'kempe'}
+    assert_valid(solver.current_solution, variables)
+
+
+def _reference_section_cost(evaluator, busy_slots):
+    """Section gaps and load imbalance, scored slot by slot without the pattern tables."""
+    weights, penalty, daily_load = evaluator.weights, 0, []
+    for slot_ids in evaluator.slots_by_day.values():
+        day_busy = sorted(s for s in slot_ids if s in busy_slots)
+        for first, second in zip(day_busy, day_busy[1:]):
+            gap = second - first
+            if gap == 2: penalty += weights["gap_penalty"]
+            elif gap == 3: penalty += weights["gap_penalty"] * 3
+            elif gap > 3: penalty += weights["gap_penalty"] * 5
+        daily_load.append(len(day_busy))
+    if max(daily_load) - min(daily_load) > 3:
+        penalty += (max(daily_load) - min(daily_load)) * weights["daily_load_imbalance"]
+    return penalty
+
+
+def test_pattern_tables_match_slot_by_slot_scoring(sample):
+    model_data, _ = sample
+    weights = dict(se.DEFAULT_OPTIMIZATION_WEIGHTS, gap_penalty=3, daily_load_imbalance=7)
+    evaluator = se.CostEvaluator(model_data, weights=weights)
+    rng = random.Random(0)
+    slot_ids = sorted(model_data['timeslots'])
+    for _ in range(500):
+        busy = set(rng.sample(slot_ids, rng.randint(0, len(slot_ids))))
+        assert evaluator._section_cost(busy) == _reference_section_cost(evaluator, busy)
+
+
+def test_batch_deltas_match_incremental_deltas(sample):
+    model_data, _ = sample
+    random.seed(2)
+    solution, state = solve_phase1(sample)
+    evaluator = se.CostEvaluator(model_data)
+    solver = se.SimulatedAnnealingSolver(solution, state, evaluator, model_data, iterations=0, batch_size=64)
+    batch, rooms = solver.batch, list(model_data['rooms'].values())
+    checked = 0
+    for _ in range(5):
+        sessions, new_seq, new_room, valid, delta = batch.propose(64)
+        for c, s in enumerate(sessions):
+            a = solver.current_solution[solver.positions[s]]
+            moved = se.Assignment(a.session, batch.sequences[new_seq[c]], rooms[new_room[c]], a.instructor)
+            state.remove_assignment(a)
+            fits = state.is_consistent(moved.session, moved.timeslot_sequence, moved.room, moved.instructor)
+            state.add_assignment(a)
+            assert bool(valid[c]) == fits
+            if fits:
+                assert int(delta[c]) == solver.incremental.delta([a], [moved])
+                checked += 1
+        kind, move = solver.generate_neighbor()
+        if move is not None:
+            solver.current_cost = solver.incremental.apply(move.old, move.new)
+            batch.apply(move.old, move.new)
+    assert checked
+
+
+def test_batch_falls_back_to_single_moves_on_long_days(sample, monkeypatch):
+    model_data, variables = sample
+    monkeypatch.setattr(se.CostEvaluator, 'PATTERN_TABLE_LIMIT', 2)
+    random.seed(3)
+    solution, state = solve_phase1(sample)
+    solver = se.SimulatedAnnealingSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=200, batch_size=16)
+    assert solver.batch is None
+    assert_valid(solver.optimize(), variables)
+
+
+# --- Timetable state ---
+
+def test_bitmask_state_matches_slot_sets(sample):
+    model_data, variables = sample
+    rng = random.Random(0)
+    state, booked, placed = se.TimetableState(model_data), set(), []
+
+    def keys(session, seq, room, inst):
+        resources = [('room', room.room_id), ('instructor', inst.instructor_id)]
+        resources += [('section', sec.section_id) for sec in session.sections]
+        return {(resource, slot) for resource in resources for slot in seq}
+
+    for _ in range(3000):
+        var = rng.choice(variables)
+        d = var.domain
+        value = (rng.choice(d.timeslot_sequences), rng.choice(d.rooms), rng.choice(d.instructors))
+        fits = not keys(var, *value) & booked
+        assert state.is_consistent(var, *value) == fits
+        if fits and rng.random() < 0.7:
+            a = se.Assignment(var, *value)
+            state.add_assignment(a)
+            booked |= keys(var, *value)
+            placed.append(a)
+        elif placed and rng.random() < 0.3:
+            a = placed.pop(rng.randrange(len(placed)))
+            state.remove_assignment(a)
+            booked -= keys(a.session, a.timeslot_sequence, a.room, a.instructor)
+    for slot in model_data['timeslots'].values():
+        mask = state.sequence_mask([slot.slot_id])
+        assert state.rooms_busy(mask) == sum(1 << room.index for room in model_data['rooms'].values()
+                                             if (('room', room.room_id), slot.slot_id) in booked)
+
+    assert placed
+    clone, before = state.copy(), occupancy(state)
+    for a in placed: clone.remove_assignment(a)
+    assert occupancy(state) == before and not any(clone.room_masks)
+
+
+def test_model_objects_are_slotted_with_dense_indices(sample):
+    model_data, variables = sample
+    state = se.TimetableState(model_data)
+    index_maps = {'rooms': state.room_index, 'instructors': state.instructor_index, 'sections': state.section_index}
+    for key in ('courses', 'rooms', 'instructors', 'timeslots', 'sections'):
+        objects = list(model_data[key].values())
+        assert [obj.index for obj in objects] == list(range(len(objects))), key
+        assert not any(hasattr(obj, '__dict__') for obj in objects), key
+        if key in index_maps:
+            assert index_maps[key] == {obj_id: obj.index for obj_id, obj in model_data[key].items()}
+    assert sorted(var.index for var in variables) == list(range(len(variables)))
+    assert not any(hasattr(var, '__dict__') for var in variables)
+    var = variables[0]
+    assert not hasattr(se.Assignment(var, var.domain.timeslot_sequences[0], var.domain.rooms[0], var.domain.instructors[0]), '__dict__')
+
+
+# --- Phase 1 search ---
+
+@pytest.mark.parametrize("options", [
+    {},
+    {'propagation': 'forward'},
+    {'propagation': 'ac3'},
+    {'variable_ordering': 'mrv'},
+    {'variable_ordering': 'mrv', 'backjumping': True, 'restart_policy': 'luby', 'seed': 1},
+    {'propagation': 'forward', 'symmetry': False, 'seed': 2},
+])
+def test_backtracking_returns_valid_timetable(sample, options):
+    model_data, variables = sample
+    solution, _ = se.BacktrackingSolver(variables, model_data, time_limit=30, **options).solve()
+    assert_valid(solution, variables)
+
+
+def test_luby_sequence():
+    assert [se._luby(i) for i in range(1, 16)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
+
+
+def test_restarts_stop_at_the_node_budget(tight_sample):
+    model_data, variables = tight_sample
+    solver = se.BacktrackingSolver(variables, model_data, restart_policy='luby', restart_base=5, node_limit=300, seed=1)
+    assert solver.solve() == (None, None)
+    assert solver.budget_exhausted and solver.restarts > 0 and solver.nodes_visited == 300
+
+
+def test_forward_checking_matches_recomputed_domains(tight_sample):
+    model_data, variables = tight_sample
+    solver = se.BacktrackingSolver(variables, model_data, variable_ordering='mrv', node_limit=200)
+    assert solver.solve() == (None, None) and solver.budget_exhausted and solver.domain_wipeouts
+    for var in variables:
+        if var.index in solver._assigned: continue
+        m = solver._domain_masks(var)
+        sections = solver._section_indices(var)
+        expected = sum(1 << k for k in range(len(m.seq_masks)) if m.is_viable(k, solver.state, sections))
+        assert solver._live[var.index] == expected, var
+
+
+@pytest.mark.parametrize("courses, sections, slots", [
+    ({1: 2, 2: 1}, 1, 4),
+    ({1: 2}, 3, 4),
+    ({1: 2}, 3, 5),
+])
+def test_backjumping_keeps_the_verdict(small_sample, courses, sections, slots):
+    model_data, variables = small_sample(courses, sections, slots)
+    runs = []
+    for backjumping in (False, True):
+        solver = se.BacktrackingSolver(variables, model_data, backjumping=backjumping, symmetry=False, time_limit=30)
+        solution, _ = solver.solve()
+        assert not solver.budget_exhausted
+        if solution is not None: assert_valid(solution, variables)
+        runs.append((solution is not None, solver))
+    (solved, chronological), (cbj_solved, cbj) = runs
+    assert cbj_solved == solved
+    assert cbj.nodes_visited <= chronological.nodes_visited
+
+
+def test_backjumping_skips_unrelated_sessions(small_sample):
+    # Level 1's section has four sessions for three slots; level 2's sessions share nothing with them.
+    model_data, variables = small_sample({1: 2, 2: 1}, 1, 3)
+    chronological = se.BacktrackingSolver(variables, model_data, symmetry=False)
+    cbj = se.BacktrackingSolver(variables, model_data, backjumping=True, symmetry=False)
+    assert chronological.solve() == cbj.solve() == (None, None)
+    assert cbj.backjumps and cbj.nogoods
+    assert cbj.nodes_visited * 10 < chronological.nodes_visited
+
+
+@pytest.mark.parametrize("sections, slots, copies", [
+    (1, 3, 2), (1, 4, 2), (2, 3, 2), (2, 4, 2), (2, 4, 3), (2, 6, 3),
+])
+def test_symmetry_breaking_keeps_the_verdict(small_sample, sections, slots, copies):
+    # Listing the course `copies` times gives every session interchangeable twins.
+    model_data, variables = small_sample({1: 1}, sections, slots, copies=copies)
+    assert any(len(set(var.domain.room_classes)) < len(var.domain.rooms) for var in variables)
+    for backjumping in (False, True):
+        runs = []
+        for symmetry in (True, False):
+            solver = se.BacktrackingSolver(variables, model_data, symmetry=symmetry, backjumping=backjumping, time_limit=30)
+            solution, _ = solver.solve()
+            assert not solver.budget_exhausted
+            runs.append((solution, solver))
+        (solution, broken), (plain_solution, plain) = runs
+        assert len(broken._twins) == len(variables)
+        assert (solution is None) == (plain_solution is None)
+        if solution is None:
+            assert broken.nodes_visited <= plain.nodes_visited
+            continue
+        assert_valid(solution, variables)
+        sequence_of = {a.session.index: a.session.domain.sequence_index[tuple(a.timeslot_sequence)] for a in solution}
+        for idx, (_, following) in broken._twins.items():
+            if following is not None: assert sequence_of[idx] < sequence_of[following]
+
+
+def test_portfolio_returns_valid_timetable(sample):
+    model_data, variables = sample
+    solver = se.PortfolioSolver(variables, model_data, workers=2, time_limit=60)
+    solution, _ = solver.solve()
+    assert solver.winner in {strategy['name'] for strategy in solver.strategies}
+    assert_valid(solution, variables)
+
+
+def test_portfolio_strategies_share_the_deadline(tight_sample):
+    model_data, variables = tight_sample
+    se._init_phase1_worker(variables, model_data, se.multiprocessing.Event())
+    for strategy in ({'name': 'static'}, {'name': 'min-conflicts', 'engine': 'min_conflicts'}):
+        _, codes, _, seconds, _ = se._run_strategy(strategy, se.time.time() - 1)
+        assert codes is None and seconds < 1
+
+
+# --- Tabu search ---
+
+def test_tabu_only_relocations_become_tabu(sample):
+    model_data, _ = sample
+    random.seed(0)
+    solution, state = solve_phase1(sample)
+    solver = se.TabuSearchSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=50, sample_size=20)
+    a = next(a for a in solution if len(a.session.domain.rooms) > 1)
+    other_room = next(room for room in a.session.domain.rooms if room is not a.room)
+    room_move = se.Move([a], [se.Assignment(a.session, a.timeslot_sequence, other_room, a.instructor)])
+    assert solver._relocations(room_move) == []
+
+    for i in range(solver.iterations):
+        before = {x.session.index: tuple(x.timeslot_sequence) for x in solver.current_solution}
+        tabu = dict(solver.tabu_until)
+        solver.step(i)
+        after = {x.session.index: tuple(x.timeslot_sequence) for x in solver.current_solution}
+        for (s, seq), until in solver.tabu_until.items():
+            if tabu.get((s, seq)) != until:
+                assert before[s] == seq != after[s]
+    assert solver.aspirations <= solver.iterations
+    assert solver.current_cost == se.CostEvaluator(model_data).calculate_total_cost(solver.current_solution, solver.current_state)
+
+
+def test_tabu_honours_patience(sample):
+    model_data, _ = sample
+    random.seed(0)
+    solution, state = solve_phase1(sample)
+    solver = se.TabuSearchSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=10 ** 6,
+                                 sample_size=5, patience=20)
+    solver.optimize()
+    assert solver.stop_reason == "no improvement in 20 steps" and solver.steps < 10 ** 6
+
+
+# --- Rooms by matching (TwoStageSolver) ---
+
+def _matching_key(edges, match):
+    matched = [(i, j) for i, j in enumerate(match) if j is not None]
+    return -len(matched), sum(edges[i][j] for i, j in matched)
+
+
+def _brute_force_matching(edges, capacity):
+    best = None
+    for choice in itertools.product(*[[None] + sorted(e) for e in edges]):
+        if any(choice.count(j) > cap for j, cap in enumerate(capacity)): continue
+        key = _matching_key(edges, choice)
+        if best is None or key < best: best = key
+    return best
+
+
+@pytest.mark.parametrize("edges, capacity, expected", [
+    ([{}, {0: 1}, {}, {0: 1003}, {0: 0}], [2], [None, 0, None, None, 0]),
+    ([{0: 1000}, {0: 1}], [1], [None, 0]),
+])
+def test_min_cost_matching_lets_cheaper_nodes_displace_matched_ones(edges, capacity, expected):
+    assert se._min_cost_matching(edges, capacity) == expected
+
+
+def test_min_cost_matching_is_optimal():
+    for seed in range(500):
+        rng = random.Random(seed)
+        capacity = [rng.randint(0, 2) for _ in range(rng.randint(1, 3))]
+        edges = [{j: rng.choice([0, 1, 5, 1000, 1003]) for j in range(len(capacity)) if rng.random() < 0.6}
+                 for _ in range(rng.randint(1, 5))]
+        match = se._min_cost_matching(edges, capacity)
+        assert all(match.count(j) <= cap for j, cap in enumerate(capacity))
+        assert all(j is None or j in edges[i] for i, j in enumerate(match))
+        assert _matching_key(edges, match) == _brute_force_matching(edges, capacity), seed
+
+
+def test_two_stage_solver_returns_valid_timetable(sample):
+    model_data, variables = sample
+    solution, _ = se.TwoStageSolver(variables, model_data, time_limit=30).solve()
+    assert_valid(solution, variables)
+
+
+def test_full_pools_keep_real_room_bookings(sample):
+    model_data, variables = sample
+    state = se.PooledTimetableState(model_data, variables)
+    var = min(variables, key=lambda v: len(v.domain.rooms))
+    seq = var.domain.timeslot_sequences[0]
+    mask = state.sequence_mask(seq)
+    pos = state.mask_positions(mask)[0]
+    pool_bits = sum(1 << room.index for room in var.domain.rooms)
+    inside = min(room.index for room in var.domain.rooms)
+    outside = next(room.index for room in model_data['rooms'].values() if not pool_bits >> room.index & 1)
+    state.reserve(rooms=[(inside, mask), (outside, mask)])
+    room_free = se.Assignment(var, seq, None, var.domain.instructors[0])
+    for _ in range(len(var.domain.rooms)): state.add_assignment(room_free)
+    assert state.slot_rooms[pos] & (pool_bits | 1 << outside) == pool_bits | 1 << outside
+    state.remove_assignment(room_free)
+    assert state.slot_rooms[pos] & (pool_bits | 1 << outside) == 1 << inside | 1 << outside
+
+
+# --- Parallel tempering ---
+
+def test_parallel_tempering_is_reproducible_across_worker_counts(sample):
+    model_data, variables = sample
+    evaluator = se.CostEvaluator(model_data)
+    results = []
+    for workers in (1, 2):
+        solution, state = solve_phase1(sample)
+        solver = se.ParallelTemperingSolver(solution, state, evaluator, model_data, iterations=300, replicas=3,
+                                            workers=workers, exchange_interval=100, seed=7)
+        best = solver.optimize()
+        assert_valid(best, variables)
+        best_state = se.TimetableState(model_data)
+        for a in best: best_state.add_assignment(a)
+        assert evaluator.calculate_total_cost(best, best_state) == solver.best_cost
+        results.append((solver.best_cost, solver.exchanges, [(a.session.index, a.timeslot_sequence, a.room.index) for a in best]))
+    assert results[0] == results[1]
+
+
+def test_parallel_tempering_stops_at_the_time_limit(sample):
+    model_data, _ = sample
+    solution, state = solve_phase1(sample)
+    calls = []
+    solver = se.ParallelTemperingSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=10 ** 9,
+                                        replicas=2, workers=1, time_limit=0.5,
+                                        progress_callback=lambda *args: calls.append(args))
+    started = se.time.time()
+    solver.optimize()
+    assert se.time.time() - started < 10
+    assert calls[-1][:2] == (10 ** 9, 10 ** 9)
+
+
+# --- Decomposition ---
+
+def test_decomposed_solver_returns_valid_timetable(sample):
+    model_data, variables = sample
+    solver = se.DecomposedSolver(variables, model_data, workers=2, time_limit=60)
+    solution, _ = solver.solve()
+    assert solver.clusters > 1
+    assert_valid(solution, variables)
+
+
+def test_component_tasks_share_the_deadline(sample):
+    model_data, variables = sample
+    se._init_phase1_worker(variables, model_data)
+    indices = [var.index for var in variables]
+    codes, _ = se._solve_component(indices, (), (), {'time_limit': 60}, deadline=se.time.time() - 1)
+    assert codes is None
+    codes, _ = se._solve_component(indices, (), (), {}, deadline=se.time.time() + 60)
+    assert codes is not None
+
+
+# --- Min-conflicts fallback ---
+
+def test_min_conflicts_returns_valid_timetable(sample):
+    model_data, variables = sample
+    solution, _ = se.MinConflictsSolver(variables, model_data, time_limit=30, seed=1).solve()
+    assert_valid(solution, variables)
+
+
+@pytest.mark.parametrize("budget_exhausted, expected_limit", [(True, 120.0), (False, se.MinConflictsSolver.DIAGNOSTIC_TIME_LIMIT)])
+def test_fallback_runs_in_full_only_after_a_timeout(sample_frames, monkeypatch, budget_exhausted, expected_limit):
+    def give_up(self):
+        self.budget_exhausted = budget_exhausted
+        return None, None
+    limits = []
+    original_init = se.MinConflictsSolver.__init__
+    def recording_init(self, *args, time_limit=30.0, **kwargs):
+        limits.append(time_limit)
+        original_init(self, *args, time_limit=time_limit, **kwargs)
+    monkeypatch.setattr(se.BacktrackingSolver, 'solve', give_up)
+    monkeypatch.setattr(se.MinConflictsSolver, '__init__', recording_init)
+    df = se.run_web_solver(sample_frames, se.DEFAULT_OPTIMIZATION_WEIGHTS, iterations=200, phase1_time_limit=120.0)
+    assert limits == [expected_limit]
+    assert not df.empty
+
+
+# --- Annealing ---
+
+def test_moves_apply_and_undo_in_place(sample):
+    model_data, _ = sample
+    random.seed(1)
+    solution, state = solve_phase1(sample)
+    solver = se.SimulatedAnnealingSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=0)
+    live = solver.current_solution
+
+    def snapshot():
+        by_sequence = {seq: dict(entries) for seq, entries in solver.by_sequence.items() if entries}
+        return occupancy(state), list(live), by_sequence
+
+    before = snapshot()
+    for _ in range(300):
+        kind, move = solver.generate_neighbor()
+        if move is None: continue
+        assert solver.current_state is state and solver.current_solution is live, kind
+        assert [live[solver.positions[a.session.index]] for a in move.new] == move.new, kind
+        move.undo(live, state, solver.positions, solver.by_sequence)
+        assert snapshot() == before, kind
+
+    a, b = live[0], live[1]
+    clash = se.Move([a], [se.Assignment(a.session, b.timeslot_sequence, b.room, a.instructor)])
+    assert not clash.try_apply(live, state, solver.positions, solver.by_sequence)
+    assert snapshot() == before
+
+def test_best_snapshots_decode_to_the_best_timetable(sample):
+    model_data, variables = sample
+    random.seed(6)
+    solution, state = solve_phase1(sample)
+    evaluator = se.CostEvaluator(model_data)
+    solver = se.SimulatedAnnealingSolver(solution, state, evaluator, model_data, iterations=0, initial_temp=5.0)
+
+    def values(assignments):
+        return [(a.session.index, tuple(a.timeslot_sequence), a.room.index, a.instructor.index) for a in assignments]
+
+    improvements = 0
+    for _ in range(20):
+        best_cost = solver.best_cost
+        solver.anneal(100)
+        assert values(solver._decode(solver.codes)) == values(solver.current_solution)
+        assert solver.best_codes is not solver.codes
+        best = solver._decode(solver.best_codes)
+        assert_valid(best, variables)
+        best_state = se.TimetableState(model_data)
+        for a in best: best_state.add_assignment(a)
+        assert evaluator.calculate_total_cost(best, best_state) == solver.best_cost
+        improvements += solver.best_cost < best_cost
+    assert improvements
+
+
+def test_penalty_sampler_tracks_weights(sample):
+    model_data, _ = sample
+    random.seed(4)
+    solution, state = solve_phase1(sample)
+    solver = se.SimulatedAnnealingSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=2000,
+                                         initial_temp=5.0)
+    solver.anneal(2000)
+    sampler = solver.sampler
+    weights = [sampler.weight(a.session.index) for a in solver.current_solution]
+    assert sampler.weights == pytest.approx(weights)
+    assert sampler.total == pytest.approx(sum(weights))
+
+    sampler.rng = random.Random(0)
+    draws = 40000
+    counts = [0] * len(weights)
+    for _ in range(draws): counts[sampler.sample()] += 1
+    for i, w in enumerate(weights):
+        expected = draws * w / sum(weights)
+        assert abs(counts[i] - expected) < 5 * expected ** 0.5 + 5
+
+
+def test_progress_reaches_the_end_after_an_early_stop(sample):
+    model_data, _ = sample
+    random.seed(0)
+    solution, state = solve_phase1(sample)
+    calls = []
+    solver = se.SimulatedAnnealingSolver(solution, state, se.CostEvaluator(model_data), model_data, iterations=100000,
+                                         progress_callback=lambda i, n, cost: calls.append((i, n, cost)),
+                                         target_acceptance=0.3, adaptive=True, patience=200)
+    solver.optimize()
+    assert solver.stop_reason is not None and solver.steps < solver.iterations
+    assert calls[-1] == (100000, 100000, solver.best_cost)
+
+
+def test_calibration_sets_the_reheat_scale(sample):
+    model_data, _ = sample
+    random.seed(0)
+    solution, state = solve_phase1(sample)
+    solver = se.SimulatedAnnealingSolver(solution, state, se.CostEvaluator(model_data), model_data, initial_temp=1000.0)
+    temp = solver.calibrate_temperature(0.3)
+    assert solver.initial_temp == solver._best_temp == temp != 1000.0
+    for target in (0, 1, 1.5):
+        with pytest.raises(ValueError):
+            solver.calibrate_temperature(target)
+
+
+# --- Large neighbourhood search ---
+
+def test_lns_keeps_a_valid_timetable_and_its_cost(sample):
+    model_data, variables = sample
+    solution, state = solve_phase1(sample)
+    evaluator = se.CostEvaluator(model_data)
+    start_cost = evaluator.calculate_total_cost(solution, state)
+    solver = se.LargeNeighborhoodSearch(solution, state, evaluator, model_data, iterations=20, seed=3)
+    best = solver.optimize()
+    assert_valid(best, variables)
+    assert solver.best_cost == evaluator.calculate_total_cost(best, solver.current_state) <= start_cost
+
+
+# --- Variable generation ---
+
+def _fewest_groups(sizes, capacity):
+    """Smallest number of groups of at most `capacity` students, by brute force over group labels."""
+    oversized = sum(1 for size in sizes if size > capacity)
+    fitting = [size for size in sizes if size <= capacity]
+    for count in range(1, len(fitting) + 1):
+        for labels in itertools.product(range(count), repeat=len(fitting)):
+            loads = [0] * count
+            for size, label in zip(fitting, labels): loads[label] += size
+            if max(loads) <= capacity: return count + oversized
+    return oversized
+
+
+def test_lecture_packing_uses_fewest_groups(sample):
+    model_data, _ = sample
+    generator = se.VariableGenerator(model_data, max_group_capacity=75)
+    for seed in range(60):
+        rng = random.Random(seed)
+        sizes = [rng.choice([10, 20, 25, 30, 35, 40, 50, 80]) for _ in range(rng.randint(1, 7))]
+        sections = [se.Section(f"X-s{i}", "X", 1, "Core", size) for i, size in enumerate(sizes)]
+        groups = generator._pack_sections(sections, 75)
+        assert sorted(s.section_id for g in groups for s in g) == sorted(s.section_id for s in sections)
+        assert all(len(g) == 1 or sum(s.student_count for s in g) <= 75 for g in groups)
+        assert len(groups) == _fewest_groups(sizes, 75), sizes
+
+
+def test_section_index_matches_a_full_scan(sample):
+    model_data, variables = sample
+    expected = {}
+    for req in model_data['available_courses']:
+        course = model_data['courses'].get(req.course_id)
+        if course is None: continue
+        for sec in model_data['sections'].values():
+            if (sec.department, sec.level) == (req.department, req.level) and \
+                    (req.specialization == 'Core' or sec.specialization == req.specialization):
+                for kind, duration in (('Lecture', course.lecture_duration), ('Lab', course.lab_duration)):
+                    if duration > 0: expected.setdefault((course.course_id, kind), set()).add(sec.section_id)
+    found = {}
+    for var in variables:
+        found.setdefault((var.course.course_id, var.session_type), set()).update(sec.section_id for sec in var.sections)
+    assert found == expected
+
+
+# --- Domains ---
+
+def _scanned_domain(session, model_data):
+    """Sequences, rooms and instructors of `session` by scanning every timeslot, room and instructor."""
+    by_day = {}
+    for slot in sorted(model_data['timeslots'].values(), key=lambda slot: slot.slot_id):
+        by_day.setdefault(slot.day, []).append(slot.slot_id)
+    n = session.duration_slots
+    sequences = {tuple(slots[i:i + n]) for slots in by_day.values() for i in range(len(slots) - n + 1)
+                 if all(b == a + 1 for a, b in zip(slots[i:i + n], slots[i + 1:i + n]))}
+    rooms = set()
+    for room in model_data['rooms'].values():
+        if room.capacity < session.total_student_count: continue
+        if session.session_type == 'Lab' and room.type_of_space != session.course.lab_type: continue
+        if session.session_type == 'Lecture' and (room.type_of_space in {'Drawing Studio', 'Computer'} or
+                                                  not session.is_small_group and room.room_type != 'Lecture'): continue
+        rooms.add(room)
+    instructors = model_data['instructors'].values()
+    preferred = {inst for inst in instructors if inst.instructor_id in session.preferred_instructors}
+    qualified = {inst for inst in instructors if session.course.course_id in inst.qualified_courses}
+    return sequences, rooms, preferred or qualified
+
+
+def test_compiled_domains_match_a_full_scan(sample):
+    model_data, variables = sample
+    for var in variables:
+        sequences, rooms, instructors = _scanned_domain(var, model_data)
+        d = var.domain
+        assert set(d.timeslot_sequences) == sequences and len(d.timeslot_sequences) == len(sequences)
+        assert set(d.rooms) == rooms and [r.capacity for r in d.rooms] == sorted(r.capacity for r in d.rooms)
+        assert set(d.instructors) == instructors
+        for inst in d.instructors:
+            assert set(d.sequences_for(inst)) == {seq for seq in sequences if not set(seq) & inst.not_preferred_slots}
+    shared = {}
+    for var in variables:
+        kind = var.course.lab_type if var.session_type == 'Lab' else var.is_small_group
+        key = (var.duration_slots, var.session_type, kind, var.total_student_count, var.domain.instructors)
+        assert shared.setdefault(key, var.domain) is var.domain
+
+
+def test_sequences_cover_every_duration(sample):
+    model_data, _ = sample
+    compiler = se.DomainCompiler(model_data)
+    session = se.ClassSession(next(iter(model_data['courses'].values())), 'Lecture', 1)
+    for duration in (1, 2, 3):
+        session.duration_slots = duration
+        assert set(compiler.sequences(duration)) == _scanned_domain(session, model_data)[0]
+        assert compiler.sequences(duration) is compiler.sequences(duration)